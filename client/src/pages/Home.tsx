@@ -345,7 +345,7 @@ const ImageSearch = () => {
                 onClick={() => handleImageClick(index)}
               >
                 <img
-                  src={`${loginUser.serverUrl}/timebox/api/image/${image.file_path}`}
+                  src={`${loginUser.serverUrl}/timebox/api/image/${image.file_path}?size=medium`}
                   alt={`Screenshot ${index + 1}`}
                   className="w-full object-contain"
                 />
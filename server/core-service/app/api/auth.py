@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 from app.core.auth import authenticate_user, login_user, logout_user
 from app.db.database import get_db
@@ -22,8 +22,8 @@ async def logout(request: Request):
     }
 
 @router.post("/login")
-async def login(request: Request, login_request: LoginRequest, db: Session = Depends(get_db)):
-    user = authenticate_user(db, login_request.username, login_request.password)
+async def login(request: Request, login_request: LoginRequest, db: AsyncSession = Depends(get_db)):
+    user = await authenticate_user(db, login_request.username, login_request.password)
     if not user:
         return {
             "status": 401,
@@ -1,7 +1,7 @@
 # app/api/items.py
 
 import os
-from fastapi import APIRouter, HTTPException, UploadFile, File
+from fastapi import APIRouter, HTTPException, UploadFile, File, Header
 from typing import List
 from pydantic import BaseModel
 from app.core.config import settings
@@ -10,15 +10,25 @@ from PIL.ExifTags import TAGS
 from io import BytesIO
 import json
 import logging
-from sqlalchemy.orm import Session
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends
-from app.db.database import get_db
+from app.db.database import get_db, SessionLocal
+from app.db import partitions
 from app.models.image import Image as ImageModel
 from datetime import datetime
-from sqlalchemy import select
-from sqlalchemy.orm import aliased
+from sqlalchemy import select, insert, tuple_, cast, column, REAL, Numeric, and_, or_
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.exc import DBAPIError
 from app.models.image_ocr import ImageOCR
-from fastapi.responses import FileResponse
+from app.models.image_embedding import ImageEmbedding
+from app.services.scheduler import ocr_scheduler, notify_new_images
+from app.services import tokenizer, dedup, thumbnails
+from app.services.embedding_processor import embedding_processor
+from fastapi.responses import FileResponse, Response
+from starlette.formparsers import MultiPartParser
 from datetime import datetime, timedelta
 from sqlalchemy.sql import func
 from sqlalchemy.sql import text
@@ -31,6 +41,16 @@ logger = logging.getLogger(__name__)
 class UploadImageResponse(BaseModel):
     status: int
     id: int
+
+class BatchUploadItem(BaseModel):
+    filename: str | None = None
+    status: int
+    id: int | None = None
+    message: str | None = None
+
+class BatchUploadResponse(BaseModel):
+    status: int
+    results: List[BatchUploadItem]
  
 
 # 添加请求模型
@@ -39,109 +59,426 @@ class SearchRequest(BaseModel):
     type: int
     startDate: str | None = None
     endDate: str | None = None
-    limit: int = 20  # 每次加载数量
+    limit: int = 50  # 每次加载数量
     last_id: int | None = None  # 游标ID
+    last_captured_at: str | None = None  # 游标截图时间
+    last_rank: float | None = None  # 游标匹配分数（关键词搜索）或向量距离（相似搜索）
+
+# 搜索类型，与客户端一致
+SEARCH_TYPE_HYBRID = 1  # 综合
+SEARCH_TYPE_KEYWORD = 2  # 精确
+SEARCH_TYPE_SEMANTIC = 3  # 相似
 
 router = APIRouter()
 
+# 上传流程中的图片解析和磁盘写入在有界线程池中执行，避免阻塞事件循环
+_upload_executor = ThreadPoolExecutor(
+    max_workers=settings.UPLOAD_IO_WORKERS,
+    thread_name_prefix="upload-io"
+)
+
+# starlette 默认上传文件超过 1MB 就转存到临时文件，之后每个数据块都要切换到线程池写入，
+# 截图通常有 1-3MB，提高上限让解析表单时不再频繁往返线程池
+MultiPartParser.max_file_size = settings.UPLOAD_SPOOL_MAX_SIZE
+
+def _ocr_summary_expr(ocr):
+    """
+    搜索结果使用的 OCR 数据：优先读取预先计算的 ocr_summary，
+    旧数据没有该字段时由 PostgreSQL 从 ocr_metadata 中裁剪出 text/confidence
+    """
+    item = func.jsonb_array_elements(ocr.ocr_metadata['ocr_result']).table_valued(column('value', JSONB)).alias('item')
+    ocr_result = (
+        select(
+            func.coalesce(
+                func.jsonb_agg(
+                    func.jsonb_build_object(
+                        'text', item.c.value['text'],
+                        'confidence', func.round(item.c.value['confidence'].astext.cast(Numeric) * 100)
+                    )
+                ),
+                func.jsonb_build_array()
+            )
+        )
+        .scalar_subquery()
+    )
+    trimmed = func.jsonb_build_object(
+        'timestamp', ocr.ocr_metadata['timestamp'],
+        'active_app', ocr.ocr_metadata['active_app'],
+        'window_title', ocr.ocr_metadata['window_title'],
+        'ocr_result', ocr_result
+    )
+    return func.coalesce(ocr.ocr_summary, trimmed, type_=JSONB)
+
+# 表达式与请求参数无关，只构建一次，避免每次搜索重复构建子查询
+_OCR_SUMMARY = _ocr_summary_expr(ImageOCR).label('ocr_summary')
+
+def _date_conditions(search_data: SearchRequest, image) -> list:
+    """截图时间过滤条件"""
+    conditions = []
+    if search_data.startDate:
+        start_date = datetime.strptime(search_data.startDate, "%Y-%m-%d %H:%M:%S")
+        conditions.append(image.captured_at >= start_date)
+    if search_data.endDate:
+        end_date = datetime.strptime(search_data.endDate, "%Y-%m-%d %H:%M:%S")
+        conditions.append(image.captured_at <= end_date)
+    return conditions
+
+def _same_image(image, child):
+    """按 id 和分区键关联，分区表之间可以按分区逐一连接"""
+    return and_(image.id == child.id, image.captured_at == child.captured_at)
+
+async def _keyword_candidates(processed_query: str, search_data: SearchRequest) -> list:
+    """全文检索候选：GIN 索引匹配，按 ts_rank 取前 SEARCH_HYBRID_CANDIDATES 条"""
+    ts_query = func.to_tsquery('simple', processed_query)
+    stmt = (
+        select(ImageModel.id, ImageModel.captured_at)
+        .join(ImageOCR, _same_image(ImageModel, ImageOCR))
+        .where(ImageOCR.search_vector.op('@@')(ts_query), ImageModel.deleted_at == None)
+        .where(*_date_conditions(search_data, ImageModel), *_date_conditions(search_data, ImageOCR))
+        .order_by(func.ts_rank(ImageOCR.search_vector, ts_query).desc(), ImageModel.id.desc())
+        .limit(settings.SEARCH_HYBRID_CANDIDATES)
+    )
+    # 与向量检索并发执行，各自使用独立的会话
+    async with SessionLocal() as db:
+        return (await db.execute(stmt)).all()
+
+async def _semantic_candidates(query_embedding: List[float], search_data: SearchRequest) -> list:
+    """向量检索候选：HNSW 索引按余弦距离取前 SEARCH_HYBRID_CANDIDATES 条"""
+    distance = ImageEmbedding.text_embedding.cosine_distance(query_embedding)
+    stmt = (
+        select(ImageModel.id, ImageModel.captured_at)
+        .join(ImageEmbedding, _same_image(ImageModel, ImageEmbedding))
+        .where(ImageModel.deleted_at == None)
+        .where(*_date_conditions(search_data, ImageModel), *_date_conditions(search_data, ImageEmbedding))
+        .order_by(distance)
+        .limit(settings.SEARCH_HYBRID_CANDIDATES)
+    )
+    async with SessionLocal() as db:
+        await db.execute(
+            select(func.set_config(
+                'hnsw.ef_search',
+                str(max(settings.EMBEDDING_HNSW_EF_SEARCH, settings.SEARCH_HYBRID_CANDIDATES)),
+                True
+            ))
+        )
+        return (await db.execute(stmt)).all()
+
+def _reciprocal_rank_fusion(*candidate_lists: list) -> list:
+    """
+    倒数排名融合：score = Σ 1 / (k + 名次)，只依赖各路结果的名次，
+    不需要把 ts_rank 和向量距离换算到同一尺度。
+    返回按 (score, captured_at, id) 倒序排列的列表
+    """
+    fused = {}
+    for candidates in candidate_lists:
+        for position, row in enumerate(candidates, start=1):
+            score, captured_at = fused.get(row.id, (0.0, row.captured_at))
+            fused[row.id] = (score + 1.0 / (settings.SEARCH_RRF_K + position), captured_at)
+    return sorted(
+        ((score, captured_at, image_id) for image_id, (score, captured_at) in fused.items()),
+        reverse=True
+    )
+
+def _elapsed_ms(started: float) -> float:
+    return round((time.perf_counter() - started) * 1000, 2)
+
+async def _hybrid_search(search_data: SearchRequest, query: str, limit: int, db: AsyncSession) -> dict:
+    """
+    综合搜索：全文检索和向量检索并发取候选，倒数排名融合后只查询当前页的详细数据
+    """
+    timings = {}
+    started = time.perf_counter()
+    processed_query = tokenizer.parse_query(query)
+
+    async def keyword_stage():
+        if processed_query is None:
+            return []
+        stage_started = time.perf_counter()
+        candidates = await _keyword_candidates(processed_query, search_data)
+        timings["keyword_ms"] = _elapsed_ms(stage_started)
+        return candidates
+
+    async def semantic_stage():
+        # 词嵌入模型不可用或向量检索失败时只使用全文检索的结果
+        try:
+            stage_started = time.perf_counter()
+            query_embedding = await embedding_processor.embed_query(query)
+            timings["embedding_ms"] = _elapsed_ms(stage_started)
+            stage_started = time.perf_counter()
+            candidates = await _semantic_candidates(query_embedding, search_data)
+            timings["semantic_ms"] = _elapsed_ms(stage_started)
+            return candidates
+        except Exception as e:
+            logger.error(f"向量检索失败, 只使用全文检索结果: {str(e)}")
+            timings["semantic_fallback"] = True
+            return []
+
+    keyword_rows, semantic_rows = await asyncio.gather(keyword_stage(), semantic_stage())
+
+    stage_started = time.perf_counter()
+    fused = _reciprocal_rank_fusion(keyword_rows, semantic_rows)
+    # 游标分页：跳过上一页最后一条及之前的结果
+    if search_data.last_id is not None and search_data.last_captured_at and search_data.last_rank is not None:
+        last_captured_at = datetime.strptime(search_data.last_captured_at, "%Y-%m-%d %H:%M:%S")
+        cursor = (search_data.last_rank, last_captured_at, search_data.last_id)
+        fused = [item for item in fused if item < cursor]
+    page = fused[:limit]
+    timings["fusion_ms"] = _elapsed_ms(stage_started)
+
+    stage_started = time.perf_counter()
+    rows = {}
+    if page:
+        stmt = (
+            select(ImageModel.id, ImageModel.file_path, _OCR_SUMMARY)
+            .join(ImageOCR, _same_image(ImageModel, ImageOCR))
+            .where(tuple_(ImageModel.id, ImageModel.captured_at).in_(
+                [(image_id, captured_at) for _, captured_at, image_id in page]
+            ))
+        )
+        rows = {row.id: row for row in (await db.execute(stmt)).all()}
+    timings["fetch_ms"] = _elapsed_ms(stage_started)
+    timings["total_ms"] = _elapsed_ms(started)
+
+    processed_results = [
+        {
+            "file_path": rows[image_id].file_path,
+            "ocr_metadata": rows[image_id].ocr_summary
+        }
+        for _, _, image_id in page
+        if image_id in rows
+    ]
+
+    # 候选之外的结果不再返回，翻页深度不超过 SEARCH_HYBRID_CANDIDATES
+    next_cursor = None
+    if len(fused) > limit:
+        score, captured_at, image_id = page[-1]
+        next_cursor = {
+            "last_id": image_id,
+            "last_captured_at": captured_at.strftime("%Y-%m-%d %H:%M:%S"),
+            "last_rank": score,
+        }
+
+    return {
+        "status": 200,
+        "results": processed_results,
+        "next_cursor": next_cursor,
+        "timings": timings
+    }
+
+async def _prepare_image_async(filename: str, content: bytes) -> dict:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_upload_executor, _prepare_image, filename, content)
+
+def _webp_exif_chunk(image_content: bytes) -> bytes | None:
+    """在 WebP 的 RIFF 容器中查找 EXIF 块"""
+    offset = 12
+    while offset + 8 <= len(image_content):
+        fourcc = image_content[offset:offset + 4]
+        size = int.from_bytes(image_content[offset + 4:offset + 8], "little")
+        if fourcc == b"EXIF":
+            return image_content[offset + 8:offset + 8 + size]
+        # 块按偶数字节对齐
+        offset += 8 + size + (size & 1)
+    return None
+
+def _read_exif(image_content: bytes):
+    """
+    读取图片的 EXIF。客户端上传的 WebP 直接从 RIFF 容器中取出 EXIF 块解析：
+    Pillow 打开 WebP 时会创建解码器并分配整幅画布，上传突发时会和事件循环争抢 CPU
+    """
+    if image_content[:4] == b"RIFF" and image_content[8:12] == b"WEBP":
+        chunk = _webp_exif_chunk(image_content)
+        if chunk is None:
+            return None
+        exif = Image.Exif()
+        exif.load(chunk)
+        return exif
+    image = Image.open(BytesIO(image_content))
+    if hasattr(image, '_getexif'):
+        return image._getexif()
+    return None
+
 def get_image_metadata(image_content: bytes) -> dict:
     """
     从图片内容中提取 ImageDescription 中的元数据
     """
     try:
-        image = Image.open(BytesIO(image_content))
-        if hasattr(image, '_getexif'):
-            exif = image._getexif()
-            if exif:
-                desc = exif.get(0x010e)  # ImageDescription tag
-                if desc:
-                    try:
-                        import base64
-                        
-                        # 确保 desc 是字符串
-                        if isinstance(desc, bytes):
-                            desc = desc.decode('ascii')
-                            
-                        # base64 解码
-                        decoded_bytes = base64.b64decode(desc)
-                        # 将解码后的字节转换为 UTF-8 字符串
-                        decoded_str = decoded_bytes.decode('utf-8')
+        exif = _read_exif(image_content)
+        if exif:
+            desc = exif.get(0x010e)  # ImageDescription tag
+            if desc:
+                try:
+                    import base64
+                    
+                    # 确保 desc 是字符串
+                    if isinstance(desc, bytes):
+                        desc = desc.decode('ascii')
                         
-                        # 记录日志用于调试
-                        # logger.info(f"base64 解码后的元数据: {decoded_str}")
-                        
-                        # 解析 JSON
-                        metadata = json.loads(decoded_str)
-                        return metadata
-                    except Exception as e:
-                        logger.error(f"解析元数据失败: {str(e)}, 原始数据: {desc}")
-                        return {}
+                    # base64 解码
+                    decoded_bytes = base64.b64decode(desc)
+                    # 将解码后的字节转换为 UTF-8 字符串
+                    decoded_str = decoded_bytes.decode('utf-8')
+                    
+                    # 记录日志用于调试
+                    # logger.info(f"base64 解码后的元数据: {decoded_str}")
+                    
+                    # 解析 JSON
+                    metadata = json.loads(decoded_str)
+                    return metadata
+                except Exception as e:
+                    logger.error(f"解析元数据失败: {str(e)}, 原始数据: {desc}")
+                    return {}
     except Exception as e:
         logger.error(f"处理图片元数据时出错: {str(e)}")
         return {}
     
     return {}
 
+def _prepare_image(filename: str, content: bytes) -> dict:
+    """
+    解析上传文件名与元数据，计算感知哈希，返回待入库的图片记录。
+    文件在去重之后才保存
+    """
+    # 获取元数据
+    metadata = get_image_metadata(content)
+    app_name = metadata.get('appName')
+    window_title = metadata.get('windowTitle')
+    
+    # 处理文件名和路径
+    name_parts = os.path.splitext(filename)
+    date_time = name_parts[0]
+    extension = name_parts[1][1:]
+    
+    directory = date_time[2:8]
+    file_name = date_time[9:]
+    relative_path = f"{directory}/{file_name}.{extension}"
+    
+    # 从文件名解析时间
+    try:
+        date_str = f"20{directory[:2]}-{directory[2:4]}-{directory[4:6]} {file_name[:2]}:{file_name[2:4]}:{file_name[4:6]}"
+        captured_at = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail="无法获取有效的截屏时间")
+    
+    # 感知哈希，用于识别内容不变的重复截图。需要完整解码图片，只在开启去重时计算
+    phash = None
+    if settings.DEDUP_ENABLED:
+        try:
+            with Image.open(BytesIO(content)) as image:
+                phash = dedup.compute_hash(image)
+        except Exception as e:
+            logger.error(f"计算图片哈希失败 {filename}: {str(e)}")
+
+    return {
+        "file_path": relative_path,
+        "file_extension": extension,
+        "app_name": app_name,
+        "window_title": window_title,
+        "captured_at": captured_at,
+        "ocr_completed": False,
+        "embedding_completed": False,
+        "phash": phash,
+    }
+
+def _save_image_file(relative_path: str, content: bytes):
+    full_save_path = os.path.join(settings.UPLOAD_DIR, relative_path)
+    os.makedirs(os.path.dirname(full_save_path), exist_ok=True)
+    try:
+        with open(full_save_path, "wb") as f:
+            f.write(content)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail="文件保存失败")
+
+async def _store_images(db: AsyncSession, rows: List[dict], contents: List[bytes]) -> List[int | Exception]:
+    """
+    保存文件并写入图片记录，返回每张图片的ID，保存文件失败的返回异常。
+    本进程缓存的分区已被分离时（如执行了 detach 命令），清除缓存、重建分区后重试一次
+    """
+    try:
+        return await _insert_images(db, [dict(row) for row in rows], contents)
+    except DBAPIError as e:
+        if not partitions.is_missing_partition(e):
+            raise
+        await db.rollback()
+        logger.warning(f"写入图片时分区不存在, 重新创建分区后重试: {str(e.orig)}")
+        partitions.forget_months(row["captured_at"] for row in rows)
+        return await _insert_images(db, [dict(row) for row in rows], contents)
+
+async def _insert_images(db: AsyncSession, rows: List[dict], contents: List[bytes]) -> List[int | Exception]:
+    """
+    保存文件并在一个事务中写入图片记录，返回每张图片的ID，保存文件失败的返回异常。
+    开启去重时，重复截图不保存文件，记录指向原图并复用原图的文件，由调度器复制原图的OCR结果
+    """
+    # 建分区需要锁住父表，必须在本事务读取图片表之前完成
+    await partitions.ensure_partitions(row["captured_at"] for row in rows)
+    links = await dedup.link_duplicates(db, rows, contents) if settings.DEDUP_ENABLED else {}
+    originals = [index for index in range(len(rows)) if index not in links]
+
+    # 并发保存原图文件
+    loop = asyncio.get_running_loop()
+    saved = await asyncio.gather(
+        *(
+            loop.run_in_executor(_upload_executor, _save_image_file, rows[index]["file_path"], contents[index])
+            for index in originals
+        ),
+        return_exceptions=True
+    )
+    results: List[int | Exception] = [None] * len(rows)
+    for index, error in zip(originals, saved):
+        if isinstance(error, Exception):
+            results[index] = error
+    originals = [index for index in originals if results[index] is None]
+
+    if originals:
+        stmt = insert(ImageModel).returning(ImageModel.id, sort_by_parameter_order=True)
+        ids = (await db.scalars(stmt, [rows[index] for index in originals])).all()
+        for index, image_id in zip(originals, ids):
+            rows[index]["id"] = results[index] = image_id
+
+    duplicates = []
+    for index, original in links.items():
+        if "id" not in original:
+            # 原图保存失败
+            results[index] = HTTPException(status_code=500, detail="文件保存失败")
+            continue
+        duplicates.append(index)
+        rows[index] = {
+            **rows[index],
+            "file_path": original["file_path"],
+            "file_extension": original["file_extension"],
+            "duplicate_of": original["id"],
+        }
+    if duplicates:
+        stmt = insert(ImageModel).returning(ImageModel.id, sort_by_parameter_order=True)
+        ids = (await db.scalars(stmt, [rows[index] for index in duplicates])).all()
+        for index, image_id in zip(duplicates, ids):
+            results[index] = image_id
+        logger.info(f"跳过 {len(duplicates)} 张重复截图")
+
+    if originals or duplicates:
+        await notify_new_images(db)
+    await db.commit()
+    if originals or duplicates:
+        ocr_scheduler.wake()
+    return results
+
 @router.post("/upload", response_model=UploadImageResponse)
 async def upload_image(
     file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
         if not file.content_type.startswith('image/'):
             raise HTTPException(status_code=400, detail="只支持图片文件上传")
         
         content = await file.read()
-        
-        # 获取元数据
-        metadata = get_image_metadata(content)
-        app_name = metadata.get('appName')
-        window_title = metadata.get('windowTitle')
-        
-        # 处理文件名和路径
-        filename = file.filename
-        name_parts = os.path.splitext(filename)
-        date_time = name_parts[0]
-        extension = name_parts[1][1:]
-        
-        directory = date_time[2:8]
-        file_name = date_time[9:]
-        relative_path = f"{directory}/{file_name}.{extension}"
-        
-        # 从文件名解析时间
-        try:
-            date_str = f"20{directory[:2]}-{directory[2:4]}-{directory[4:6]} {file_name[:2]}:{file_name[2:4]}:{file_name[4:6]}"
-            captured_at = datetime.strptime(date_str, "%Y-%m-%d %H:%M:%S")
-        except ValueError as e:
-            raise HTTPException(status_code=400, detail="无法获取有效的截屏时间")
-        
-        # 构建完整的保存路径
-        full_save_path = os.path.join(settings.UPLOAD_DIR, directory, f"{file_name}.{extension}")
-        os.makedirs(os.path.dirname(full_save_path), exist_ok=True)
-        
-        # 保存文件
-        try:
-            with open(full_save_path, "wb") as f:
-                f.write(content)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail="文件保存失败")
-
-        db_image = ImageModel(
-            file_path=relative_path,
-            file_extension=extension,
-            app_name=app_name,
-            window_title=window_title,
-            captured_at=captured_at,
-            ocr_completed=False,
-            embedding_completed=False
-        )
-        
-        db.add(db_image)
-        db.commit()
-        db.refresh(db_image)
+        row = await _prepare_image_async(file.filename, content)
+        result = (await _store_images(db, [row], [content]))[0]
+        if isinstance(result, Exception):
+            raise result
         return {
             "status": 200,
-            "id": db_image.id,
+            "id": result,
         }
         
     except HTTPException:
@@ -150,101 +487,267 @@ async def upload_image(
         logger.error(f"处理上传请求时发生错误: {str(e)}")
         raise HTTPException(status_code=500, detail="服务器内部错误")
 
+@router.post("/upload/batch", response_model=BatchUploadResponse)
+async def upload_images(
+    files: List[UploadFile] = File(...),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    批量上传截图，所有记录在一个事务中批量插入
+    """
+    if len(files) > settings.MAX_BATCH_UPLOAD_FILES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"单次最多上传 {settings.MAX_BATCH_UPLOAD_FILES} 个文件"
+        )
+
+    contents: List[bytes] = [b""] * len(files)
+
+    async def prepare(index: int, file: UploadFile) -> dict:
+        if not file.content_type or not file.content_type.startswith('image/'):
+            raise HTTPException(status_code=400, detail="只支持图片文件上传")
+        contents[index] = await file.read()
+        return await _prepare_image_async(file.filename, contents[index])
+
+    # 并发解析文件，单个文件失败不影响其他文件
+    prepared = await asyncio.gather(*(prepare(index, file) for index, file in enumerate(files)), return_exceptions=True)
+
+    results: List[dict] = [
+        {"filename": file.filename, "status": 200, "id": None, "message": None}
+        for file in files
+    ]
+
+    def set_error(index: int, error: Exception):
+        if isinstance(error, HTTPException):
+            results[index]["status"] = error.status_code
+            results[index]["message"] = error.detail
+        else:
+            logger.error(f"处理批量上传文件 {files[index].filename} 时发生错误: {str(error)}")
+            results[index]["status"] = 500
+            results[index]["message"] = "服务器内部错误"
+
+    rows: List[dict] = []
+    row_indexes: List[int] = []
+    for index, row in enumerate(prepared):
+        if isinstance(row, Exception):
+            set_error(index, row)
+        else:
+            rows.append(row)
+            row_indexes.append(index)
+
+    # 一次批量插入，一次提交
+    if rows:
+        try:
+            stored = await _store_images(db, rows, [contents[index] for index in row_indexes])
+        except Exception as e:
+            await db.rollback()
+            logger.error(f"批量写入图片记录时发生错误: {str(e)}")
+            raise HTTPException(status_code=500, detail="服务器内部错误")
+
+        for index, result in zip(row_indexes, stored):
+            if isinstance(result, Exception):
+                set_error(index, result)
+            else:
+                results[index]["id"] = result
+
+    return {
+        "status": 200,
+        "results": results,
+    }
+
 @router.post("/search")
 async def search_images(
     search_data: SearchRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     try:
         query = search_data.query.strip()
+        limit = max(1, min(search_data.limit, settings.SEARCH_MAX_LIMIT))
+
+        if query and search_data.type == SEARCH_TYPE_HYBRID and settings.EMBEDDING_ENABLED:
+            return await _hybrid_search(search_data, query, limit, db)
         
         # 基础查询
-        ImageAlias = aliased(ImageModel)
-        ImageOcrAlias = aliased(ImageOCR)
+        # 直接使用映射类而不是每次请求创建别名，省去别名的列适配开销
+        ocr_summary = _OCR_SUMMARY
+        rank = None
+        distance = None
         
         if not query:
             # 没有查询词时，仅按照截图时间倒序
             base_query = (
-                select(ImageAlias.file_path, ImageOcrAlias.ocr_metadata)
-                .join(ImageOcrAlias, ImageAlias.id == ImageOcrAlias.id)
+                select(ImageModel.id, ImageModel.captured_at, ImageModel.file_path, ocr_summary)
+                .join(ImageOCR, _same_image(ImageModel, ImageOCR))
+            )
+        elif search_data.type == SEARCH_TYPE_SEMANTIC and settings.EMBEDDING_ENABLED:
+            # 相似搜索：按与查询向量的余弦距离升序，ORDER BY 距离 + LIMIT 使用 HNSW 索引
+            query_embedding = await embedding_processor.embed_query(query)
+            distance = ImageEmbedding.text_embedding.cosine_distance(query_embedding)
+            await db.execute(
+                select(func.set_config('hnsw.ef_search', str(settings.EMBEDDING_HNSW_EF_SEARCH), True))
+            )
+            base_query = (
+                select(
+                    ImageModel.id,
+                    ImageModel.captured_at,
+                    ImageModel.file_path,
+                    ocr_summary,
+                    distance.label('rank')
+                )
+                .join(ImageOCR, _same_image(ImageModel, ImageOCR))
+                .join(ImageEmbedding, _same_image(ImageModel, ImageEmbedding))
+                .where(*_date_conditions(search_data, ImageEmbedding))
             )
         else:
-            # 有查询词时，计算匹配分数并按分数倒序
-            keywords = query.split()
-            processed_query = ' & '.join(keywords)
+            # 有查询词时，使用与索引相同的分词器切分查询词，计算匹配分数并按分数倒序
+            processed_query = tokenizer.parse_query(query)
+            if processed_query is None:
+                return {"status": 200, "results": [], "next_cursor": None}
+            ts_query = func.to_tsquery('simple', processed_query)
+            rank = func.ts_rank(ImageOCR.search_vector, ts_query)
             base_query = (
                 select(
-                    ImageAlias.file_path, 
-                    ImageOcrAlias.ocr_metadata,
-                    func.ts_rank(ImageOcrAlias.search_vector, func.to_tsquery('simple', processed_query)).label('rank')
+                    ImageModel.id,
+                    ImageModel.captured_at,
+                    ImageModel.file_path, 
+                    ocr_summary,
+                    rank.label('rank')
                 )
-                .join(ImageOcrAlias, ImageAlias.id == ImageOcrAlias.id)
-                .where(ImageOcrAlias.search_vector.match(processed_query))
+                .join(ImageOCR, _same_image(ImageModel, ImageOCR))
+                .where(ImageOCR.search_vector.op('@@')(ts_query))
             )
 
-        # 添加日期过滤条件
-        if search_data.startDate:
-            start_date = datetime.strptime(search_data.startDate, "%Y-%m-%d %H:%M:%S")
-            base_query = base_query.where(ImageAlias.captured_at >= start_date)
-        
-        if search_data.endDate:
-            end_date = datetime.strptime(search_data.endDate, "%Y-%m-%d %H:%M:%S")
-            base_query = base_query.where(ImageAlias.captured_at <= end_date)
+        # 已被保留策略删除的截图不再返回
+        base_query = base_query.where(ImageModel.deleted_at == None)
+
+        # 添加日期过滤条件，两张分区表都带上条件才能各自裁剪分区
+        base_query = base_query.where(
+            *_date_conditions(search_data, ImageModel),
+            *_date_conditions(search_data, ImageOCR)
+        )
+
+        # 游标分页：从上一页最后一条记录之后继续，避免 OFFSET 扫描
+        if search_data.last_id is not None and search_data.last_captured_at:
+            last_captured_at = datetime.strptime(search_data.last_captured_at, "%Y-%m-%d %H:%M:%S")
+            position = tuple_(ImageModel.captured_at, ImageModel.id) < tuple_(last_captured_at, search_data.last_id)
+            if rank is None and distance is None:
+                base_query = base_query.where(position)
+            elif distance is not None and search_data.last_rank is not None:
+                # 距离升序，距离相同时按时间倒序
+                base_query = base_query.where(or_(
+                    distance > search_data.last_rank,
+                    and_(distance == search_data.last_rank, position)
+                ))
+            elif search_data.last_rank is not None:
+                # ts_rank 返回 real，游标中的分数需转换回 real 才能精确比较
+                base_query = base_query.where(
+                    tuple_(rank, ImageModel.captured_at, ImageModel.id)
+                    < tuple_(cast(search_data.last_rank, REAL), last_captured_at, search_data.last_id)
+                )
 
         # 添加排序条件
-        if not query:
-            stmt = base_query.order_by(ImageAlias.captured_at.desc())
+        if distance is not None:
+            stmt = base_query.order_by(distance, ImageModel.captured_at.desc(), ImageModel.id.desc())
+        elif rank is None:
+            stmt = base_query.order_by(ImageModel.captured_at.desc(), ImageModel.id.desc())
         else:
-            stmt = base_query.order_by(text('rank DESC'), ImageAlias.captured_at.desc())
+            stmt = base_query.order_by(rank.desc(), ImageModel.captured_at.desc(), ImageModel.id.desc())
         
-        stmt = stmt.limit(50)
-
-        results = db.execute(stmt).all()
-
-        # 处理结果，移除 position 字段
-        processed_results = []
-        for result in results:
-            metadata = result.ocr_metadata
-            if metadata and 'ocr_result' in metadata:
-                for item in metadata['ocr_result']:
-                    if 'position' in item:
-                        del item['position']
-                    if 'confidence' in item:
-                        item['confidence'] = round(item['confidence'] * 100)
-            
-            processed_results.append({
+        stmt = stmt.limit(limit)
+
+        results = (await db.execute(stmt)).all()
+
+        # position 已在数据库中裁剪掉，直接返回
+        processed_results = [
+            {
                 "file_path": result.file_path,
-                "ocr_metadata": metadata
-            })
+                "ocr_metadata": result.ocr_summary
+            }
+            for result in results
+        ]
+
+        # 返回下一页游标，结果不足一页时说明已无更多数据
+        next_cursor = None
+        if len(results) == limit:
+            last = results[-1]
+            next_cursor = {
+                "last_id": last.id,
+                "last_captured_at": last.captured_at.strftime("%Y-%m-%d %H:%M:%S"),
+                "last_rank": last.rank if rank is not None or distance is not None else None,
+            }
 
         return {
             "status": 200,
-            "results": processed_results
+            "results": processed_results,
+            "next_cursor": next_cursor
         }
 
     except Exception as e:
         logger.error(f"处理搜索请求时发生错误: {str(e)}")
         raise HTTPException(status_code=500, detail="服务器内部错误")
 
+# 原图按文件后缀返回对应的类型，缩略图统一为 WebP
+_MEDIA_TYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "gif": "image/gif",
+    "webp": "image/webp",
+}
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
 @router.get("/{directory}/{filename}")
-async def get_image(directory: str, filename: str):
+async def get_image(
+    directory: str,
+    filename: str,
+    size: str | None = None,
+    if_none_match: str | None = Header(default=None)
+):
+    """
+    获取截图。size 为 THUMBNAIL_SIZES 中的尺寸名称时返回缩略图，不传时返回原图。
+    支持 ETag/If-None-Match，内容未变化时返回 304
+    """
     try:
+        if size is not None and size not in settings.THUMBNAIL_SIZES:
+            raise HTTPException(status_code=400, detail="不支持的缩略图尺寸")
+
         # 构建完整的文件路径
-        file_path = os.path.join(settings.UPLOAD_DIR, directory, filename)
+        relative_path = os.path.join(directory, filename)
+        file_path = os.path.join(settings.UPLOAD_DIR, relative_path)
         
         # 检查文件是否存在
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="图片未找到")
-            
-        # 设置缓存时间（30天）
+
+        # 设置缓存时间（30天），过期后通过 ETag 重新验证
         cache_time = 30 * 24 * 60 * 60  # 30天的秒数
+        etag = thumbnails.etag(file_path, size)
+        headers = {
+            "Cache-Control": f"public, max-age={cache_time}",
+            "ETag": etag,
+        }
+        if _etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=headers)
+
+        if size is not None:
+            loop = asyncio.get_running_loop()
+            file_path = await loop.run_in_executor(_upload_executor, thumbnails.get_thumbnail, relative_path, size)
+            media_type = "image/webp"
+        else:
+            extension = os.path.splitext(filename)[1].lstrip(".").lower()
+            media_type = _MEDIA_TYPES.get(extension, "application/octet-stream")
         
         # 返回图片文件，设置 Content-Disposition 为 inline
         return FileResponse(
             file_path,
-            media_type="image/webp",
+            media_type=media_type,
             headers={
-                "Cache-Control": f"public, max-age={cache_time}",
+                **headers,
                 "Content-Disposition": "inline"
             }
         )
@@ -1,5 +1,7 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends, HTTPException, status, Request
+from starlette.concurrency import run_in_threadpool
 from app.models.user import User as UserModel
 from app.db.database import get_db
 import bcrypt
@@ -28,14 +30,16 @@ def get_password_hash(password: str) -> str:
         print(f"密码哈希出错: {str(e)}")
         raise ValueError(f"密码哈希失败: {str(e)}")
 
-def authenticate_user(db: Session, username: str, password: str):
-    user = db.query(UserModel).filter(UserModel.username == username).first()
+async def authenticate_user(db: AsyncSession, username: str, password: str):
+    result = await db.execute(select(UserModel).where(UserModel.username == username))
+    user = result.scalars().first()
     
     if not user:
         return None
         
     try:
-        if not verify_password(password, user.hashed_password):
+        # bcrypt 校验是CPU密集操作，放到线程池中执行
+        if not await run_in_threadpool(verify_password, password, user.hashed_password):
             return None
     except Exception as e:
         print(f"Password verification error: {e}")  # 添加调试信息
@@ -43,7 +47,7 @@ def authenticate_user(db: Session, username: str, password: str):
         
     return user
 
-async def get_current_user(request: Request, db: Session = Depends(get_db)):
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)):
     user_id = request.session.get("user_id")
     if user_id is None:
         raise HTTPException(
@@ -51,7 +55,7 @@ async def get_current_user(request: Request, db: Session = Depends(get_db)):
             detail="Not authenticated",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    user = db.query(UserModel).filter(UserModel.id == user_id).first()
+    user = await db.get(UserModel, user_id)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -21,6 +21,14 @@ class Settings(BaseSettings):
     POSTGRES_PASSWORD: str = "password"
     POSTGRES_DB: str = "app_db"
     
+    # 数据库连接池配置
+    DB_POOL_SIZE: int = 10  # 连接池常驻连接数
+    DB_MAX_OVERFLOW: int = 20  # 超出常驻连接数后允许额外创建的连接数
+    DB_POOL_TIMEOUT: int = 30  # 获取连接的等待超时（秒）
+    DB_POOL_RECYCLE: int = 1800  # 连接回收时间（秒）
+    DB_POOL_PRE_PING: bool = True  # 使用连接前先检测连接是否可用
+    DB_STATEMENT_CACHE_SIZE: int = 100  # 每个连接缓存的预编译语句数量，0 表示关闭
+    
     # Session配置
     SECRET_KEY: str = "your-secret-key"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60
@@ -32,6 +40,39 @@ class Settings(BaseSettings):
     UPLOAD_DIR: str = "uploads/screenshots"  # 默认上传目录
     MAX_UPLOAD_SIZE: int = 10 * 1024 * 1024  # 最大上传大小（10MB）
     ALLOWED_EXTENSIONS: set = {".png", ".jpg", ".jpeg", ".gif", ".webp"}
+    MAX_BATCH_UPLOAD_FILES: int = 500  # 批量上传单次最大文件数
+    UPLOAD_IO_WORKERS: int = 4  # 上传时解析图片和写磁盘的线程数
+    UPLOAD_SPOOL_MAX_SIZE: int = 8 * 1024 * 1024  # 上传文件在内存中缓冲的上限，超过后才写入临时文件
+    THUMBNAIL_DIR: str = "uploads/thumbnails"  # 缩略图缓存目录
+    THUMBNAIL_SIZES: dict[str, int] = {"small": 320, "medium": 640, "large": 1280}  # 缩略图尺寸名称与宽度
+    THUMBNAIL_QUALITY: int = 75  # 缩略图 WebP 质量
+    
+    # 搜索配置
+    SEARCH_MAX_LIMIT: int = 200  # 单页最大返回数量
+    SEARCH_HYBRID_CANDIDATES: int = 200  # 综合搜索时关键词和向量各取的候选数量，也是可翻页的最大深度
+    SEARCH_RRF_K: int = 60  # 倒数排名融合（RRF）的平滑常数
+    
+    # 分区配置
+    PARTITION_PREMAKE_MONTHS: int = 3  # 预先创建未来几个月的分区
+    
+    # 存储保留策略，天数为 0 表示不启用该阶段
+    RETENTION_REENCODE_DAYS: int = 0  # 超过该天数的截图重新编码
+    RETENTION_REENCODE_QUALITY: int = 60  # 重新编码的 WebP 质量
+    RETENTION_REENCODE_MAX_WIDTH: int = 1920  # 重新编码的最大宽度
+    RETENTION_THUMBNAIL_DAYS: int = 0  # 超过该天数的截图只保留缩略图
+    RETENTION_THUMBNAIL_WIDTH: int = 480  # 缩略图宽度
+    RETENTION_THUMBNAIL_QUALITY: int = 50  # 缩略图 WebP 质量
+    RETENTION_DELETE_DAYS: int = 0  # 超过该天数的截图删除
+    RETENTION_BATCH_SIZE: int = 50  # 每批处理的图片数
+    RETENTION_MAX_BATCHES: int = 100  # 每轮每个阶段最多处理的批数
+    RETENTION_INTERVAL: int = 3600  # 执行间隔（秒）
+
+    # 重复截图检测
+    DEDUP_ENABLED: bool = False  # 上传时跳过与同一应用/窗口上一张截图逐像素相同的截图
+    DEDUP_HASH_SIZE: int = 16  # 差值哈希边长，哈希共 DEDUP_HASH_SIZE² 位
+    DEDUP_MAX_DISTANCE: int = 0  # 汉明距离不超过该值时再逐像素比较
+    DEDUP_WINDOW_SECONDS: int = 600  # 只与该时间窗口内的截图比较
+    DEDUP_MAX_WAITS: int = 3  # 原图OCR失败时重复截图最多等待的次数，之后自行识别
     
     # 默认用户配置
     DEFAULT_USERNAME: str = "admin"
@@ -42,13 +83,53 @@ class Settings(BaseSettings):
     OCR_SERVICE_TOKENS: str = "token1,token2"
     OCR_SERVICE_MAX_RETRIES: int = 3
     OCR_SERVICE_TIMEOUT: int = 60
+    OCR_BATCH_SIZE: int = 16  # 每次批量请求发送的图片数
+    OCR_HASH_LOOKUP: bool = True  # 上传前先用图片的 SHA-256 查询OCR服务的结果缓存，命中时不再上传
+    OCR_HTTP_POOL_SIZE: int = 8  # 每个OCR服务的最大连接数
+    OCR_HTTP_KEEPALIVE_TIMEOUT: int = 60  # 空闲连接保持时间（秒）
+    OCR_CIRCUIT_FAILURE_THRESHOLD: int = 3  # 连续失败多少次后熔断该服务
+    OCR_CIRCUIT_COOLDOWN: int = 30  # 熔断时间（秒），熔断后再次失败时翻倍
+    OCR_CIRCUIT_MAX_COOLDOWN: int = 600  # 最大熔断时间（秒）
     
     # 并发控制
     OCR_CONCURRENT_LIMIT: int = 1  # 每个服务同时处理的图片数量限制
+    OCR_PIPELINE_DEPTH: int = 8  # 每个OCR服务保持在处理中的图片数
+    OCR_WRITE_BATCH_SIZE: int = 50  # OCR结果单次合并写入的最大数量
+    OCR_IDLE_POLL_INTERVAL: int = 300  # 已订阅新图片通知时的兜底轮询间隔（秒）
+    OCR_CLAIM_DELAY: float = 0.5  # 被唤醒后延迟认领的时间（秒），上传突发时合并成一次认领，减少与请求争抢事件循环
+    OCR_LEASE_SECONDS: int = 120  # 调度器认领图片的租约时长（秒），处理中会定期续约
+    IMAGE_NOTIFY_CHANNEL: str = "timebox_new_images"  # 新图片通知的 LISTEN/NOTIFY 频道
+
+    # 增量OCR：与同一窗口的上一帧比较，只识别变化的区域。合并结果依赖变化检测，默认关闭
+    OCR_INCREMENTAL_ENABLED: bool = False
+    OCR_INCREMENTAL_TILE_SIZE: int = 32  # 比较分块的边长（像素）
+    OCR_INCREMENTAL_PIXEL_THRESHOLD: int = 24  # 灰度差超过该值的像素视为变化，忽略压缩噪声
+    OCR_INCREMENTAL_MARGIN: int = 8  # 变化区域向外扩展的像素
+    OCR_INCREMENTAL_MAX_CHANGED_RATIO: float = 0.5  # 变化面积超过该比例时识别整张图片
+    OCR_INCREMENTAL_WINDOW_SECONDS: int = 300  # 上一帧与当前截图的最大时间间隔（秒）
+    
+    # 分词配置
+    TOKENIZER: str = "jieba"  # 分词器: jieba / simple
+    TOKENIZER_USER_DICT: Optional[str] = None  # 自定义词典路径（jieba 词典格式）
+    TOKENIZER_CACHE_DIR: Optional[str] = "data/tokenizer"  # 词典前缀缓存目录，为空时使用系统临时目录
+    TOKENIZER_CACHE_SIZE: int = 100000  # 分词结果缓存的行数
+    TOKENIZER_WORKERS: int = 2  # 分词进程数，0 表示在线程池中分词
+    
+    # 词嵌入配置
+    EMBEDDING_ENABLED: bool = True  # 关闭后只做OCR，不生成词嵌入
+    EMBEDDING_MODEL: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"  # 本地句向量模型（fastembed）
+    EMBEDDING_DIM: int = 384  # 向量维度，需与模型一致
+    EMBEDDING_BATCH_SIZE: int = 32  # 每批推理的文本数
+    EMBEDDING_THREADS: int = 2  # 推理线程数
+    EMBEDDING_MAX_CHARS: int = 512  # 参与嵌入的文本最大长度
+    EMBEDDING_CACHE_DIR: Optional[str] = "data/models"  # 模型下载目录
+    EMBEDDING_HNSW_M: int = 16  # HNSW 索引每个节点的连接数
+    EMBEDDING_HNSW_EF_CONSTRUCTION: int = 64  # HNSW 建索引时的候选列表大小
+    EMBEDDING_HNSW_EF_SEARCH: int = 200  # 查询时的候选列表大小，也是相似搜索可翻页的最大深度
     
     @property
     def SQLALCHEMY_DATABASE_URI(self) -> str:
-        return f"postgresql://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
+        return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}@{self.POSTGRES_SERVER}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
     
     @property
     def OCR_SERVICES(self) -> List[OCRServiceConfig]:
@@ -1,17 +1,83 @@
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+import logging
+from sqlalchemy import text, inspect
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from app.core.config import settings
 
 SQLALCHEMY_DATABASE_URL = settings.SQLALCHEMY_DATABASE_URI
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+logger = logging.getLogger(__name__)
+
+# 异步引擎（asyncpg），数据库等待不会阻塞事件循环
+engine = create_async_engine(
+    SQLALCHEMY_DATABASE_URL,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT,
+    pool_recycle=settings.DB_POOL_RECYCLE,
+    pool_pre_ping=settings.DB_POOL_PRE_PING,
+    connect_args={
+        # asyncpg 每个连接缓存的预编译语句数量
+        "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+    },
+)
+SessionLocal = async_sessionmaker(engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close() 
\ No newline at end of file
+
+def _add_missing_columns(conn):
+    """create_all 不会为已存在的表补充新增字段，这里逐个检查并补充"""
+    inspector = inspect(conn)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN IF NOT EXISTS {column_ddl}"))
+
+def _create_missing_indexes(conn):
+    """create_all 不会为已存在的表补建索引，这里逐个检查并补建"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+async def _reset_missing_embeddings(conn):
+    """
+    旧版本不生成词嵌入，直接把图片标记为 embedding_completed，关闭词嵌入期间处理的图片也是如此。
+    启用词嵌入时把没有词嵌入记录的图片重新标记为待处理，由调度器补齐，否则语义/混合检索会漏掉这些图片
+    """
+    result = await conn.execute(text(
+        "UPDATE t_images SET embedding_completed = false "
+        "WHERE embedding_completed AND ocr_completed AND deleted_at IS NULL "
+        "AND NOT EXISTS ("
+        "SELECT 1 FROM t_image_embeddings e WHERE e.id = t_images.id AND e.captured_at = t_images.captured_at"
+        ")"
+    ))
+    if result.rowcount:
+        logger.info(f"{result.rowcount} 张图片缺少词嵌入, 已重新加入处理队列")
+
+async def init_db():
+    """创建所有表和索引"""
+    from app.db import partitions
+
+    async with engine.begin() as conn:
+        # 词嵌入使用 pgvector
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        # 旧版本的未分区表先移走，创建分区表后再导入数据
+        migrating = await partitions.move_legacy_tables(conn)
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_create_missing_indexes)
+        if migrating:
+            await partitions.copy_legacy_tables(conn)
+        if settings.EMBEDDING_ENABLED:
+            await _reset_missing_embeddings(conn)
+
+    await partitions.load_partitions()
+    await partitions.premake_partitions()
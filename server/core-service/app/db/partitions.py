@@ -0,0 +1,229 @@
+"""
+按截图时间（captured_at）按月分区：
+
+- t_images、t_image_ocr、t_image_embeddings 在模型中声明为 RANGE (captured_at) 分区表，父表由 create_all 创建
+- 启动时创建当前月及之后 PARTITION_PREMAKE_MONTHS 个月的分区，之后每天检查一次
+- 上传时按截图时间按需创建分区（客户端补传的截图可能早于当前月）
+- 带日期条件的查询只扫描相关月份；旧月份可以整体分离为独立表后归档或删除，不需要 DELETE + VACUUM:
+    python -m app.db.partitions detach 2024-01
+"""
+import argparse
+import asyncio
+import logging
+from datetime import date, datetime
+from typing import Iterable, List, Set
+from sqlalchemy import Table, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection
+from app.core.config import settings
+from app.db.database import Base, engine
+
+logger = logging.getLogger(__name__)
+
+# 旧的未分区表迁移时临时存放的 schema
+LEGACY_SCHEMA = "timebox_legacy"
+
+# 已确认存在的分区月份，避免每次上传都查询数据库
+_known_months: Set[date] = set()
+
+def partitioned_tables() -> List[Table]:
+    """按依赖顺序返回所有分区表，被引用的表在前"""
+    return [
+        table for table in Base.metadata.sorted_tables
+        if table.dialect_options["postgresql"].get("partition_by")
+    ]
+
+def month_of(value: datetime | date) -> date:
+    return date(value.year, value.month, 1)
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(table_name: str, month: date) -> str:
+    return f"{table_name}_{month:%Y%m}"
+
+async def _attached_partitions(conn: AsyncConnection, table_name: str) -> Set[str]:
+    result = await conn.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :table_name"
+        ),
+        {"table_name": table_name}
+    )
+    return set(result.scalars().all())
+
+async def create_partitions(conn: AsyncConnection, months: Iterable[date]):
+    """在当前事务中为所有分区表创建缺少的月份分区"""
+    months = sorted(set(months))
+    if not months:
+        return
+    # 多个进程可能同时为同一个月份建分区，用事务级咨询锁串行化
+    await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('timebox_partitions'))"))
+    for table in partitioned_tables():
+        attached = await _attached_partitions(conn, table.name)
+        for month in months:
+            name = partition_name(table.name, month)
+            if name in attached:
+                continue
+            await conn.execute(text(
+                f"CREATE TABLE {name} PARTITION OF {table.name} "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+            ))
+            logger.info(f"已创建分区: {name}")
+
+async def ensure_partitions(values: Iterable[datetime | date]):
+    """确保给定时间所在的月份都已有分区，在独立的短事务中创建，不影响调用方事务"""
+    months = {month_of(value) for value in values} - _known_months
+    if not months:
+        return
+    async with engine.begin() as conn:
+        await create_partitions(conn, months)
+    _known_months.update(months)
+
+def forget_months(values: Iterable[datetime | date]):
+    """
+    清除分区缓存。分区可能被其他进程（如 detach 命令）分离，
+    写入时报 is_missing_partition 错误后清除对应月份，再次 ensure_partitions 时重新检查
+    """
+    _known_months.difference_update(month_of(value) for value in values)
+
+def is_missing_partition(error: DBAPIError) -> bool:
+    """写入的截图时间没有对应分区（check_violation: no partition of relation ... found for row）"""
+    return getattr(error.orig, "sqlstate", None) == "23514" and "no partition of relation" in str(error.orig)
+
+async def premake_partitions():
+    """创建当前月及之后 PARTITION_PREMAKE_MONTHS 个月的分区"""
+    current = month_of(datetime.now())
+    await ensure_partitions(add_months(current, i) for i in range(settings.PARTITION_PREMAKE_MONTHS + 1))
+
+async def partition_maintenance_loop():
+    """每天检查一次未来月份的分区"""
+    while True:
+        try:
+            await premake_partitions()
+        except Exception as e:
+            logger.error(f"创建分区失败: {str(e)}")
+        await asyncio.sleep(24 * 60 * 60)
+
+async def _relkind(conn: AsyncConnection, table_name: str, schema: str = "public") -> str | None:
+    return await conn.scalar(
+        text(
+            "SELECT c.relkind::text FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+            "WHERE n.nspname = :schema AND c.relname = :table_name"
+        ),
+        {"schema": schema, "table_name": table_name}
+    )
+
+async def move_legacy_tables(conn: AsyncConnection) -> bool:
+    """
+    旧版本创建的是普通表，无法直接转换为分区表。
+    先把它们连同索引、序列移到 LEGACY_SCHEMA，create_all 创建分区表后再由 copy_legacy_tables 导入数据
+    """
+    legacy = [
+        table for table in partitioned_tables()
+        if await _relkind(conn, table.name) == "r"
+    ]
+    if not legacy:
+        return False
+    await conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {LEGACY_SCHEMA}"))
+    for table in legacy:
+        await conn.execute(text(f"ALTER TABLE {table.name} SET SCHEMA {LEGACY_SCHEMA}"))
+    logger.warning(f"检测到未分区的旧表，正在迁移为分区表: {', '.join(table.name for table in legacy)}")
+    return True
+
+async def _legacy_columns(conn: AsyncConnection, table_name: str) -> List[str]:
+    result = await conn.execute(
+        text(
+            "SELECT column_name FROM information_schema.columns "
+            "WHERE table_schema = :schema AND table_name = :table_name"
+        ),
+        {"schema": LEGACY_SCHEMA, "table_name": table_name}
+    )
+    return list(result.scalars().all())
+
+async def copy_legacy_tables(conn: AsyncConnection):
+    """把 LEGACY_SCHEMA 中的旧数据导入分区表，完成后删除旧表"""
+    images = f"{LEGACY_SCHEMA}.t_images"
+    months = (await conn.execute(
+        text(f"SELECT DISTINCT date_trunc('month', captured_at)::date FROM {images}")
+    )).scalars().all()
+    await create_partitions(conn, months)
+
+    for table in partitioned_tables():
+        legacy_columns = await _legacy_columns(conn, table.name)
+        if not legacy_columns:
+            continue
+        columns = [column.name for column in table.columns if column.name in legacy_columns]
+        if "captured_at" in legacy_columns:
+            select_list = ", ".join(f"legacy.{name}" for name in columns)
+            source = f"{LEGACY_SCHEMA}.{table.name} legacy"
+        else:
+            # 子表的分区键来自对应的图片
+            columns.append("captured_at")
+            select_list = ", ".join([*(f"legacy.{name}" for name in columns[:-1]), "image.captured_at"])
+            source = f"{LEGACY_SCHEMA}.{table.name} legacy JOIN {images} image ON image.id = legacy.id"
+        result = await conn.execute(text(
+            f"INSERT INTO {table.name} ({', '.join(columns)}) SELECT {select_list} FROM {source}"
+        ))
+        logger.info(f"已迁移 {table.name}: {result.rowcount} 行")
+
+    await conn.execute(text(
+        "SELECT setval(pg_get_serial_sequence('t_images', 'id'), COALESCE((SELECT max(id) FROM t_images), 0) + 1, false)"
+    ))
+    await conn.execute(text(f"DROP SCHEMA {LEGACY_SCHEMA} CASCADE"))
+
+async def load_partitions():
+    """读取已存在的分区月份"""
+    async with engine.connect() as conn:
+        names = await _attached_partitions(conn, "t_images")
+    for name in names:
+        suffix = name.rsplit("_", 1)[-1]
+        if suffix.isdigit() and len(suffix) == 6:
+            _known_months.add(date(int(suffix[:4]), int(suffix[4:]), 1))
+
+async def detach_month(month: date):
+    """
+    把某个月的分区从所有分区表中分离为独立表，之后可以 pg_dump 归档或直接 DROP。
+    先分离引用方（OCR、词嵌入），并删除分离后表上仍指向 t_images 的外键，最后分离 t_images 分区。
+    分离后的表重命名为 <分区名>_detached_<时间>，之后补传该月的截图时可以重新创建同名分区。
+    服务进程中缓存的分区月份不受影响，写入时发现分区不存在会清除缓存后重建（见 forget_months）
+    """
+    suffix = f"detached_{datetime.now():%Y%m%d%H%M%S}"
+    async with engine.begin() as conn:
+        for table in reversed(partitioned_tables()):
+            name = partition_name(table.name, month)
+            if name not in await _attached_partitions(conn, table.name):
+                continue
+            await conn.execute(text(f"ALTER TABLE {table.name} DETACH PARTITION {name}"))
+            foreign_keys = (await conn.execute(
+                text("SELECT conname FROM pg_constraint WHERE conrelid = CAST(:name AS regclass) AND contype = 'f'"),
+                {"name": name}
+            )).scalars().all()
+            for constraint in foreign_keys:
+                await conn.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT "{constraint}"'))
+            await conn.execute(text(f"ALTER TABLE {name} RENAME TO {name}_{suffix}"))
+            logger.info(f"已分离分区: {name} -> {name}_{suffix}")
+    _known_months.discard(month)
+
+async def _main(args):
+    # 导入模型，注册所有分区表
+    from app.models import image, image_ocr, image_embedding  # noqa: F401
+    try:
+        if args.action == "detach":
+            await detach_month(month_of(datetime.strptime(args.month, "%Y-%m")))
+        elif args.action == "premake":
+            await premake_partitions()
+    finally:
+        await engine.dispose()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="分区维护")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    detach_parser = subparsers.add_parser("detach", help="分离某个月的分区")
+    detach_parser.add_argument("month", help="月份，例如 2024-01")
+    subparsers.add_parser("premake", help="创建未来月份的分区")
+    asyncio.run(_main(parser.parse_args()))
@@ -10,15 +10,19 @@ from app.api.auth import router as auth_router
 from app.core.config import settings
 from app.core.auth import get_current_user
 from fastapi.middleware.cors import CORSMiddleware
-from app.db.database import engine, Base, SessionLocal
+from sqlalchemy import select, func
+from app.db.database import engine, SessionLocal, init_db
+from app.db import partitions
 from app.models.user import User
 from app.core.auth import get_password_hash
 import os
-from app.services.scheduler import OCRScheduler
+import gc
+import asyncio
+from app.services.scheduler import ocr_scheduler
+from app.services import tokenizer
+from app.services.retention import retention_engine
 import uvicorn
 
-ocr_scheduler = OCRScheduler()
-
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,  # 设置日志级别为INFO
@@ -73,13 +77,12 @@ async def read_root():
 @app.on_event("startup")
 async def startup_event():
     # 创建所有表
-    Base.metadata.create_all(bind=engine)
+    await init_db()
 
     # 创建数据库会话
-    db = SessionLocal()
-    try:
+    async with SessionLocal() as db:
         # 检查用户表是否为空
-        user_count = db.query(User).count()
+        user_count = await db.scalar(select(func.count()).select_from(User))
         if user_count == 0:
             # 如果用户表为空，创建默认用户
             default_user = User(
@@ -87,17 +90,30 @@ async def startup_event():
                 hashed_password=get_password_hash(settings.DEFAULT_PASSWORD)  # 使用配置中的默认密码
             )
             db.add(default_user)
-            db.commit()
+            await db.commit()
             logging.info("默认用户已创建")
-    finally:
-        db.close()
 
  
-    ocr_scheduler.start()
+    # 预先加载查询分词使用的词典
+    await asyncio.to_thread(tokenizer.get_tokenizer().initialize)
+
+    await ocr_scheduler.start()
+    # 每天检查并创建未来月份的分区
+    app.state.partition_task = asyncio.create_task(partitions.partition_maintenance_loop())
+    # 按配置压缩、删除旧截图
+    retention_engine.start()
+
+    # 启动时创建的模块、ORM 映射等对象会一直存活，移出 GC 跟踪，
+    # 避免上传突发时的完整回收反复扫描它们而长时间阻塞事件循环
+    gc.collect()
+    gc.freeze()
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    ocr_scheduler.stop()
+    app.state.partition_task.cancel()
+    await retention_engine.stop()
+    await ocr_scheduler.stop()
+    await engine.dispose()
 
 def dev():
     """开发环境启动函数"""
@@ -1,11 +1,37 @@
-from sqlalchemy.types import UserDefinedType
+from sqlalchemy.types import UserDefinedType, Float
 
 class VectorType(UserDefinedType):
-    def get_col_spec(self):
-        return "VECTOR"
+    """pgvector 的 vector 类型，Python 侧使用 float 列表"""
+    cache_ok = True
+
+    def __init__(self, dim: int | None = None):
+        self.dim = dim
+
+    def get_col_spec(self, **kw):
+        return f"VECTOR({self.dim})" if self.dim else "VECTOR"
 
     def bind_expression(self, bindvalue):
         return bindvalue
 
     def column_expression(self, col):
         return col
+
+    def bind_processor(self, dialect):
+        def process(value):
+            if value is None:
+                return None
+            # 使用 vector 的文本格式 [1,2,3]
+            return "[" + ",".join(str(float(v)) for v in value) + "]"
+        return process
+
+    def result_processor(self, dialect, coltype):
+        def process(value):
+            if value is None:
+                return None
+            return [float(v) for v in value.strip("[]").split(",")]
+        return process
+
+    class comparator_factory(UserDefinedType.Comparator):
+        def cosine_distance(self, other):
+            """余弦距离（<=>），可使用 vector_cosine_ops 索引"""
+            return self.op("<=>", return_type=Float)(other)
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text
-from sqlalchemy.sql import func
+from sqlalchemy import Column, Integer, SmallInteger, String, Boolean, DateTime, Text, Index, LargeBinary
+from sqlalchemy.sql import func, text
 from sqlalchemy.dialects.postgresql import TSVECTOR
 from app.models.custom_types import VectorType
 from app.db.database import Base  # 使用共同的 Base
@@ -7,7 +7,8 @@ from app.db.database import Base  # 使用共同的 Base
 class Image(Base):
     __tablename__ = "t_images"
 
-    id = Column(Integer, primary_key=True, index=True)
+    # 分区表的主键必须包含分区键 captured_at
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     file_path = Column(Text, nullable=False)  # 文件路径
     file_extension = Column(Text)  # 文件后缀
     app_name = Column(Text)  # 活动的应用名称
@@ -15,5 +16,43 @@ class Image(Base):
     ocr_completed = Column(Boolean, default=False)  # OCR完成标志
     embedding_completed = Column(Boolean, default=False)  # 词嵌入完成标志
     created_at = Column(DateTime, server_default=func.now())  # 创建时间
-    captured_at = Column(DateTime, nullable=False)  # 截屏时间
-    deleted_at = Column(DateTime, nullable=True)  # 删除时间
\ No newline at end of file
+    captured_at = Column(DateTime, primary_key=True)  # 截屏时间，按月分区
+    deleted_at = Column(DateTime, nullable=True)  # 删除时间
+    storage_tier = Column(SmallInteger, nullable=False, default=0, server_default=text('0'))  # 存储层级：0 原图，1 已重新编码，2 仅缩略图
+    phash = Column(LargeBinary, nullable=True)  # 感知哈希，用于识别重复截图
+    duplicate_of = Column(Integer, nullable=True)  # 重复截图指向的原图ID，复用原图的文件和OCR结果
+    claimed_by = Column(Text, nullable=True)  # 认领该图片的调度器
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)  # 认领租约到期时间，过期后可被重新认领
+
+    __table_args__ = (
+        # 按时间倒序的游标分页
+        Index('idx_images_captured_at_id', 'captured_at', 'id'),
+        # 只索引待处理的图片，调度器认领时使用
+        Index(
+            'idx_images_pending',
+            'created_at',
+            postgresql_where=text('ocr_completed = false OR embedding_completed = false')
+        ),
+        # 保留策略按层级和截图时间取出待处理的图片
+        Index(
+            'idx_images_retention',
+            'storage_tier',
+            'captured_at',
+            postgresql_where=text('deleted_at IS NULL')
+        ),
+        # 上传时查找同一应用/窗口最近的原图
+        Index(
+            'idx_images_dedup',
+            'app_name',
+            'window_title',
+            'captured_at',
+            postgresql_where=text('duplicate_of IS NULL AND deleted_at IS NULL')
+        ),
+        # 保留策略删除原图前检查是否还有未过期的重复截图
+        Index(
+            'idx_images_duplicate_of',
+            'duplicate_of',
+            postgresql_where=text('duplicate_of IS NOT NULL')
+        ),
+        {'postgresql_partition_by': 'RANGE (captured_at)'},
+    )
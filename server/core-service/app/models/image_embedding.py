@@ -1,16 +1,30 @@
-from sqlalchemy import Column, Integer, ForeignKey, Index
-from sqlalchemy.dialects.postgresql import VECTOR
+from sqlalchemy import Column, Integer, DateTime, ForeignKeyConstraint, Index
+from app.models.custom_types import VectorType
 from app.db.database import Base
-from sqlalchemy.orm import relationship
+from app.core.config import settings
 
 class ImageEmbedding(Base):
     __tablename__ = "t_image_embeddings"
 
-    id = Column(Integer, ForeignKey('t_images.id', ondelete='CASCADE'), primary_key=True)
-    text_embedding = Column(VECTOR(384))  # 使用384维向量，根据实际模型调整
-    
-    image = relationship("Image", back_populates="embedding")
+    id = Column(Integer, primary_key=True)
+    captured_at = Column(DateTime, primary_key=True)  # 与 t_images 相同的分区键
+    text_embedding = Column(VectorType(settings.EMBEDDING_DIM))  # 维度与 EMBEDDING_MODEL 一致
 
     __table_args__ = (
-        Index('idx_image_text_embeddings', 'text_embedding', postgresql_using='ivfflat'),
-    ) 
\ No newline at end of file
+        ForeignKeyConstraint(
+            ['id', 'captured_at'], ['t_images.id', 't_images.captured_at'], ondelete='CASCADE'
+        ),
+        # 使用余弦距离。HNSW 不需要训练，建表时为空、之后逐条写入也能保持召回；
+        # ivfflat 在空表上建索引时没有可用的聚类中心，查询会漏掉大量结果
+        Index(
+            'idx_image_text_embeddings',
+            'text_embedding',
+            postgresql_using='hnsw',
+            postgresql_with={
+                'm': settings.EMBEDDING_HNSW_M,
+                'ef_construction': settings.EMBEDDING_HNSW_EF_CONSTRUCTION
+            },
+            postgresql_ops={'text_embedding': 'vector_cosine_ops'}
+        ),
+        {'postgresql_partition_by': 'RANGE (captured_at)'},
+    )
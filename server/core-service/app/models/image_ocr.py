@@ -1,15 +1,21 @@
-from sqlalchemy import Column, Integer, Text, ForeignKey, Index
+from sqlalchemy import Column, Integer, DateTime, ForeignKeyConstraint, Index
 from sqlalchemy.dialects.postgresql import JSONB ,TSVECTOR
 from app.db.database import Base
 
 class ImageOCR(Base):
     __tablename__ = "t_image_ocr"
 
-    id = Column(Integer, ForeignKey('t_images.id', ondelete='CASCADE'), primary_key=True)
+    id = Column(Integer, primary_key=True)
+    captured_at = Column(DateTime, primary_key=True)  # 与 t_images 相同的分区键
     ocr_metadata = Column(JSONB)
+    ocr_summary = Column(JSONB)  # 搜索结果使用的精简数据，不含 position，confidence 为百分制
     search_vector = Column(TSVECTOR)
 
     __table_args__ = (
+        ForeignKeyConstraint(
+            ['id', 'captured_at'], ['t_images.id', 't_images.captured_at'], ondelete='CASCADE'
+        ),
         Index('idx_image_ocr_search_vector', 'search_vector', postgresql_using='gin'),
+        {'postgresql_partition_by': 'RANGE (captured_at)'},
     )
  
\ No newline at end of file
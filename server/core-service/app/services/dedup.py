@@ -0,0 +1,104 @@
+"""
+重复截图检测：屏幕长时间不变时，客户端仍会持续上传内容相同的截图。
+上传时计算差值哈希（dHash），与同一应用/窗口的上一张原图比较。
+哈希只用于快速排除：少量文字变化可能不改变哈希，汉明距离不超过 DEDUP_MAX_DISTANCE 时
+还要逐像素比较，完全相同才视为重复。重复截图不保存文件，通过 duplicate_of 指向原图，
+复用原图的文件，调度器直接复制原图的OCR结果
+"""
+import asyncio
+import os
+from datetime import timedelta
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+from PIL import Image as PILImage, ImageChops
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.models.image import Image
+
+def compute_hash(image: PILImage.Image) -> bytes:
+    """
+    差值哈希：缩放为 (n+1)×n 灰度图，逐行比较相邻像素的明暗，得到 n×n 位。
+    截图中的文字较小，n 默认取 16，避免少量文字变化被忽略
+    """
+    size = settings.DEDUP_HASH_SIZE
+    pixels = list(image.convert("L").resize((size + 1, size), PILImage.BILINEAR).getdata())
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value.to_bytes((size * size + 7) // 8, "big")
+
+def hamming_distance(a: bytes, b: bytes) -> int:
+    if len(a) != len(b):
+        return len(a) * 8
+    return (int.from_bytes(a, "big") ^ int.from_bytes(b, "big")).bit_count()
+
+def same_pixels(a: bytes, b: bytes) -> bool:
+    """两张图片的尺寸和每个像素都相同"""
+    with PILImage.open(BytesIO(a)) as first, PILImage.open(BytesIO(b)) as second:
+        if first.size != second.size:
+            return False
+        return ImageChops.difference(first.convert("RGB"), second.convert("RGB")).getbbox() is None
+
+def _read_original(relative_path: str) -> Optional[bytes]:
+    try:
+        with open(os.path.join(settings.UPLOAD_DIR, relative_path), "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+async def _is_duplicate(row: dict, content: bytes, original: dict, original_content: Optional[bytes]) -> bool:
+    if row["phash"] is None or original.get("phash") is None:
+        return False
+    if row["captured_at"] - original["captured_at"] > timedelta(seconds=settings.DEDUP_WINDOW_SECONDS):
+        return False
+    if hamming_distance(row["phash"], original["phash"]) > settings.DEDUP_MAX_DISTANCE:
+        return False
+
+    def compare() -> bool:
+        # 数据库中的原图从磁盘读取，已被保留策略重新编码的原图不会逐像素相同
+        data = original_content if original_content is not None else _read_original(original["file_path"])
+        return data is not None and same_pixels(content, data)
+
+    return await asyncio.to_thread(compare)
+
+def _group(row: dict) -> Tuple[Optional[str], Optional[str]]:
+    return row.get("app_name"), row.get("window_title")
+
+async def _last_original(db: AsyncSession, group: Tuple[Optional[str], Optional[str]], before) -> Optional[dict]:
+    """同一应用/窗口在 before 之前、时间窗口内的最后一张原图"""
+    app_name, window_title = group
+    stmt = (
+        select(Image.id, Image.captured_at, Image.file_path, Image.file_extension, Image.phash)
+        .where(Image.app_name == app_name if app_name is not None else Image.app_name == None)
+        .where(Image.window_title == window_title if window_title is not None else Image.window_title == None)
+        .where(Image.captured_at <= before)
+        .where(Image.captured_at >= before - timedelta(seconds=settings.DEDUP_WINDOW_SECONDS))
+        .where(Image.duplicate_of == None, Image.deleted_at == None)
+        .order_by(Image.captured_at.desc())
+        .limit(1)
+    )
+    row = (await db.execute(stmt)).first()
+    return dict(row._mapping) if row else None
+
+async def link_duplicates(db: AsyncSession, rows: List[dict], contents: List[bytes]) -> Dict[int, dict]:
+    """
+    按截图时间顺序，把每张截图与同组的上一张原图（数据库中已有的或本批中更早的）比较。
+    返回 {重复截图在 rows 中的下标: 原图}，原图是数据库记录或本批中的 row（写入后才有 id）
+    """
+    links: Dict[int, dict] = {}
+    # 每组的上一张原图及其内容，数据库中的原图内容为 None，比较时才从磁盘读取
+    last: Dict[tuple, Tuple[Optional[dict], Optional[bytes]]] = {}
+    for index in sorted(range(len(rows)), key=lambda i: rows[i]["captured_at"]):
+        row = rows[index]
+        group = _group(row)
+        if group not in last:
+            last[group] = (await _last_original(db, group, row["captured_at"]), None)
+        original, original_content = last[group]
+        if original is not None and await _is_duplicate(row, contents[index], original, original_content):
+            links[index] = original
+        else:
+            last[group] = (row, contents[index])
+    return links
@@ -1 +1,84 @@
-# todo
\ No newline at end of file
+"""
+词嵌入：使用本地小型句向量模型（fastembed + onnxruntime）在 CPU 上批量推理，
+不依赖 GPU 和外部服务
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+def build_embedding_text(ocr_metadata: dict) -> str:
+    """构建参与嵌入的文本：应用名、窗口标题和OCR文字，超长部分截断"""
+    parts = [
+        ocr_metadata.get("active_app") or "",
+        ocr_metadata.get("window_title") or "",
+        *(item.get("text") or "" for item in ocr_metadata.get("ocr_result") or []),
+    ]
+    return "\n".join(part for part in parts if part)[:settings.EMBEDDING_MAX_CHARS]
+
+class EmbeddingProcessor:
+    """
+    模型在首次使用时加载。推理在专用线程池中执行，onnxruntime 推理时释放 GIL，不阻塞事件循环；
+    线程池保留两个线程，批量推理进行时搜索查询的向量化不需要排队
+    """
+    def __init__(self):
+        self._model = None
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _get_model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from fastembed import TextEmbedding
+                    self._model = TextEmbedding(
+                        model_name=settings.EMBEDDING_MODEL,
+                        cache_dir=settings.EMBEDDING_CACHE_DIR,
+                        threads=settings.EMBEDDING_THREADS,
+                    )
+                    logger.info(f"词嵌入模型已加载: {settings.EMBEDDING_MODEL}")
+        return self._model
+
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """在当前线程中批量推理"""
+        model = self._get_model()
+        return [
+            embedding.tolist()
+            for embedding in model.embed(texts, batch_size=settings.EMBEDDING_BATCH_SIZE)
+        ]
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="embedding")
+            # 后台预加载模型，避免第一批推理或第一次搜索等待
+            self._executor.submit(self._get_model)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """批量生成文本向量"""
+        if not texts:
+            return []
+        self.start()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.embed_texts, texts)
+
+    async def embed_query(self, query: str) -> List[float]:
+        """生成查询向量"""
+        return (await self.embed([query]))[0]
+
+# 全局实例，调度器和搜索接口共用同一个模型
+embedding_processor = EmbeddingProcessor()
+
+if __name__ == "__main__":
+    # 构建镜像时预先下载模型，容器重建或离线部署时不需要再下载
+    logging.basicConfig(level=logging.INFO)
+    embedding_processor.embed_texts(["timebox"])
+    logger.info(f"词嵌入模型已下载: {settings.EMBEDDING_CACHE_DIR}")
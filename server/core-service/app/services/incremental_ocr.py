@@ -0,0 +1,232 @@
+"""
+增量OCR：同一应用/窗口的相邻截图通常只有少量区域变化。
+把截图与同窗口的上一帧按 OCR_INCREMENTAL_TILE_SIZE 分块比较，只识别变化的区域，
+未变化区域沿用上一帧的识别结果：
+
+1. 两帧转为灰度后逐像素求差，差值超过 OCR_INCREMENTAL_PIXEL_THRESHOLD 的像素视为变化（忽略压缩噪声）
+2. 含变化像素的分块按连通区域合并为矩形，扩大 OCR_INCREMENTAL_MARGIN 像素
+3. 与区域相交的上一帧文本框并入区域，保证整行文字重新识别，不会被截断
+4. 变化面积超过 OCR_INCREMENTAL_MAX_CHANGED_RATIO，或上一帧有缺少坐标的结果（无法判断是否变化）时，
+   直接识别整张图片
+
+由 OCR_INCREMENTAL_ENABLED 开启，默认关闭
+"""
+import os
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from PIL import Image as PILImage, ImageChops
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.models.image import Image
+from app.models.image_ocr import ImageOCR
+
+Box = Tuple[float, float, float, float]
+
+@dataclass
+class BaseFrame:
+    """作为比较基准的上一帧"""
+    id: int
+    file_path: str
+    captured_at: datetime
+    ocr_result: List[dict]
+
+@dataclass
+class Plan:
+    """增量识别计划：需要识别的区域和沿用的上一帧结果"""
+    base_id: int
+    regions: List[List[int]]
+    kept: List[dict]
+
+def _bbox(position) -> Optional[Box]:
+    """文本框坐标转为 (x1, y1, x2, y2)，支持点列表和 [x1, y1, x2, y2]"""
+    if not position:
+        return None
+    if isinstance(position[0], (list, tuple)):
+        xs = [point[0] for point in position]
+        ys = [point[1] for point in position]
+        return min(xs), min(ys), max(xs), max(ys)
+    if len(position) == 4:
+        return tuple(position)
+    return None
+
+def _intersects(a: Box, b: Box) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+def _union(a: Box, b: Box) -> Box:
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+def _changed_tiles(base: PILImage.Image, image: PILImage.Image) -> Tuple[List[List[bool]], int, int]:
+    """返回每个分块是否变化，以及分块的列数和行数"""
+    tile = settings.OCR_INCREMENTAL_TILE_SIZE
+    threshold = settings.OCR_INCREMENTAL_PIXEL_THRESHOLD
+    changed = np.asarray(ImageChops.difference(base.convert("L"), image.convert("L"))) > threshold
+    height, width = changed.shape
+    rows, columns = -(-height // tile), -(-width // tile)
+    # 补齐到分块的整数倍后按块取 any，分块内只要有一个变化像素即视为变化
+    padded = np.zeros((rows * tile, columns * tile), dtype=bool)
+    padded[:height, :width] = changed
+    return padded.reshape(rows, tile, columns, tile).any(axis=(1, 3)).tolist(), columns, rows
+
+def _tile_components(changed: List[List[bool]], columns: int, rows: int) -> List[Tuple[int, int, int, int]]:
+    """变化分块的连通区域，返回分块坐标 (col1, row1, col2, row2)，不含右下边界"""
+    seen = [[False] * columns for _ in range(rows)]
+    components = []
+    for row in range(rows):
+        for col in range(columns):
+            if not changed[row][col] or seen[row][col]:
+                continue
+            seen[row][col] = True
+            stack = [(row, col)]
+            top, left, bottom, right = row, col, row, col
+            while stack:
+                r, c = stack.pop()
+                top, left, bottom, right = min(top, r), min(left, c), max(bottom, r), max(right, c)
+                for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+                    if 0 <= nr < rows and 0 <= nc < columns and changed[nr][nc] and not seen[nr][nc]:
+                        seen[nr][nc] = True
+                        stack.append((nr, nc))
+            components.append((left, top, right + 1, bottom + 1))
+    return components
+
+def _merge_overlapping(boxes: List[Box]) -> List[Box]:
+    merged = list(boxes)
+    changed = True
+    while changed:
+        changed = False
+        result: List[Box] = []
+        for box in merged:
+            for index, other in enumerate(result):
+                if _intersects(box, other):
+                    result[index] = _union(box, other)
+                    changed = True
+                    break
+            else:
+                result.append(box)
+        merged = result
+    return merged
+
+def plan(base: BaseFrame, file_path: str) -> Optional[Plan]:
+    """
+    比较上一帧和当前截图（file_path 为相对上传目录的路径），返回增量识别计划；
+    尺寸不同、上一帧结果缺少坐标或变化面积过大时返回 None，表示识别整张图片
+    """
+    boxes = [(item, _bbox(item.get("position"))) for item in base.ocr_result]
+    if any(box is None for _, box in boxes):
+        # 没有坐标的结果无法判断是否在变化区域内，沿用可能过时，丢弃会漏掉文字
+        return None
+
+    base_path = os.path.join(settings.UPLOAD_DIR, base.file_path)
+    image_path = os.path.join(settings.UPLOAD_DIR, file_path)
+    with PILImage.open(base_path) as base_image, PILImage.open(image_path) as image:
+        if base_image.size != image.size:
+            return None
+        width, height = image.size
+        changed, columns, rows = _changed_tiles(base_image, image)
+
+    tile = settings.OCR_INCREMENTAL_TILE_SIZE
+    margin = settings.OCR_INCREMENTAL_MARGIN
+    regions: List[Box] = [
+        (
+            max(0, left * tile - margin),
+            max(0, top * tile - margin),
+            min(width, right * tile + margin),
+            min(height, bottom * tile + margin),
+        )
+        for left, top, right, bottom in _tile_components(changed, columns, rows)
+    ]
+
+    # 与区域相交的旧文本框并入区域，直到区域不再扩大
+    kept = []
+    expanded = True
+    while expanded:
+        expanded = False
+        regions = _merge_overlapping(regions)
+        kept = []
+        for item, box in boxes:
+            hit = next((index for index, region in enumerate(regions) if _intersects(box, region)), None)
+            if hit is None:
+                kept.append(item)
+                continue
+            union = _union(regions[hit], box)
+            if union != regions[hit]:
+                regions[hit] = union
+                expanded = True
+
+    area = sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions)
+    if area > width * height * settings.OCR_INCREMENTAL_MAX_CHANGED_RATIO:
+        return None
+    return Plan(
+        base_id=base.id,
+        regions=[
+            [int(x1), int(y1), min(width, int(x2) + 1), min(height, int(y2) + 1)]
+            for x1, y1, x2, y2 in regions
+        ],
+        kept=kept
+    )
+
+def merge(plan: Plan, results: List[dict]) -> List[dict]:
+    """
+    合并沿用的旧结果和变化区域的新结果，按文本框位置从上到下、从左到右排序。
+    只保留中心点落在变化区域内的新结果，OCR服务不支持区域识别时也不会重复
+    """
+    regions = [tuple(region) for region in plan.regions]
+    fresh = []
+    for item in results:
+        box = _bbox(item.get("position"))
+        if box is None:
+            continue
+        x, y = (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
+        if any(x1 <= x < x2 and y1 <= y < y2 for x1, y1, x2, y2 in regions):
+            fresh.append(item)
+
+    def order(item: dict):
+        box = _bbox(item.get("position")) or (0, 0, 0, 0)
+        return box[1], box[0]
+
+    return sorted(plan.kept + fresh, key=order)
+
+async def find_base(db: AsyncSession, image: Image) -> Optional[BaseFrame]:
+    """同一应用/窗口在时间窗口内、已完成OCR且原图未压缩的上一帧"""
+    stmt = (
+        select(
+            Image.id, Image.file_path, Image.captured_at,
+            ImageOCR.ocr_metadata['ocr_result'].label('ocr_result')
+        )
+        .join(ImageOCR, and_(ImageOCR.id == Image.id, ImageOCR.captured_at == Image.captured_at))
+        .where(Image.app_name == image.app_name if image.app_name is not None else Image.app_name == None)
+        .where(Image.window_title == image.window_title if image.window_title is not None else Image.window_title == None)
+        .where(Image.captured_at < image.captured_at)
+        .where(Image.captured_at >= image.captured_at - timedelta(seconds=settings.OCR_INCREMENTAL_WINDOW_SECONDS))
+        .where(Image.duplicate_of == None, Image.deleted_at == None)
+        .where(Image.ocr_completed == True, Image.storage_tier == 0)
+        .order_by(Image.captured_at.desc())
+        .limit(1)
+    )
+    row = (await db.execute(stmt)).first()
+    if row is None:
+        return None
+    return BaseFrame(id=row.id, file_path=row.file_path, captured_at=row.captured_at, ocr_result=row.ocr_result or [])
+
+def group_key(image: Image) -> Tuple[Optional[str], Optional[str]]:
+    return image.app_name, image.window_title
+
+def split_rounds(images: List[Image], bases: Dict[tuple, BaseFrame]) -> Tuple[List[Image], List[Image]]:
+    """
+    把一批图片分为两轮，不按前后相继的帧串行，同一窗口的积压仍能并发识别：
+    数据库中已有上一帧的窗口全部在第一轮，以该帧为基准；
+    没有上一帧的窗口，第一张在第一轮识别整张，其余在第二轮以它为基准
+    """
+    groups: Dict[tuple, List[Image]] = {}
+    for image in sorted(images, key=lambda image: image.captured_at):
+        groups.setdefault(group_key(image), []).append(image)
+    first, second = [], []
+    for key, group in groups.items():
+        if key in bases:
+            first.extend(group)
+        else:
+            first.append(group[0])
+            second.extend(group[1:])
+    return first, second
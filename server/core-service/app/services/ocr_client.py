@@ -1,99 +1,409 @@
 import aiohttp
 import asyncio
-from typing import Dict, List, Optional
+import contextlib
+import hashlib
+import json
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
 import logging
 from app.core.config import settings, OCRServiceConfig
 
+class ServiceState:
+    """单个OCR服务的负载与健康状态"""
+    
+    # 平均耗时的平滑系数
+    LATENCY_ALPHA = 0.3
+
+    def __init__(self, service: OCRServiceConfig):
+        self.service = service
+        self.semaphore = asyncio.Semaphore(settings.OCR_CONCURRENT_LIMIT)
+        self.in_flight = 0  # 已分配到该服务（含排队中）且结果尚未取回的图片数，由 iter_images 统一增减
+        self.avg_latency: Optional[float] = None  # 每张图片的平均处理耗时（秒）
+        self.consecutive_failures = 0
+        self.open_until = 0.0  # 熔断截止时间，在此之前不再分配任务
+        self.supports_batch = True  # 是否支持批量接口
+        self.supports_lookup = True  # 是否支持按图片哈希查询结果缓存
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.open_until
+
+    def load_score(self) -> float:
+        """预计完成时间：排队数量 × 平均耗时，越小越空闲"""
+        latency = self.avg_latency if self.avg_latency is not None else 1.0
+        return (self.in_flight + 1) * latency
+
+    def record_success(self, latency: float):
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        if self.avg_latency is None:
+            self.avg_latency = latency
+        else:
+            self.avg_latency = self.LATENCY_ALPHA * latency + (1 - self.LATENCY_ALPHA) * self.avg_latency
+
+    def record_failure(self) -> Optional[float]:
+        """记录失败，达到阈值时熔断并返回熔断时长"""
+        self.consecutive_failures += 1
+        over = self.consecutive_failures - settings.OCR_CIRCUIT_FAILURE_THRESHOLD
+        if over < 0:
+            return None
+        # 熔断期过后允许试探一次，再失败则熔断时间翻倍
+        cooldown = min(settings.OCR_CIRCUIT_COOLDOWN * (2 ** over), settings.OCR_CIRCUIT_MAX_COOLDOWN)
+        self.open_until = time.monotonic() + cooldown
+        return cooldown
+
+class ServiceBusyError(Exception):
+    """OCR服务返回 503：等待队列已满的正常背压，不计入熔断"""
+
+def _file_hash(image_path: str) -> str:
+    """图片文件内容的 SHA-256，与OCR服务结果缓存的键一致"""
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 class OCRClient:
     def __init__(self):
         self.logger = logging.getLogger(__name__)
-        self._service_semaphores: Dict[str, asyncio.Semaphore] = {}
-        self._current_service_index = 0  # 添加服务索引计数器
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}  # 每个OCR服务一个长连接会话
         
-        # 为每个OCR服务创建信号量
-        for service in settings.OCR_SERVICES:
-            self._service_semaphores[service.url] = asyncio.Semaphore(
-                settings.OCR_CONCURRENT_LIMIT
-            )
+        # 为每个OCR服务维护负载与健康状态
+        self._states: Dict[str, ServiceState] = {
+            service.url: ServiceState(service) for service in settings.OCR_SERVICES
+        }
     
+    def _create_session(self, service: OCRServiceConfig) -> aiohttp.ClientSession:
+        """创建带连接池和 keep-alive 的会话"""
+        connector = aiohttp.TCPConnector(
+            limit=settings.OCR_HTTP_POOL_SIZE,
+            keepalive_timeout=settings.OCR_HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=300,
+        )
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers={"Authorization": f"Bearer {service.token}"},
+            timeout=aiohttp.ClientTimeout(total=service.timeout),
+        )
+
+    def _get_session(self, service: OCRServiceConfig) -> aiohttp.ClientSession:
+        session = self._sessions.get(service.url)
+        if session is None or session.closed:
+            session = self._create_session(service)
+            self._sessions[service.url] = session
+        return session
+
+    async def start(self):
+        """为每个OCR服务创建长连接会话"""
+        for service in settings.OCR_SERVICES:
+            self._get_session(service)
+
+    async def close(self):
+        """关闭所有会话"""
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            await session.close()
+
     async def _call_single_service(
         self,
         service: OCRServiceConfig,
-        image_path: str
+        image_path: str,
+        regions: Optional[List[List[int]]] = None
     ) -> Optional[List[Dict]]:
         """调用单个OCR服务"""
-        async with self._service_semaphores[service.url]:
+        async with self._states[service.url].semaphore:
             try:
-                async with aiohttp.ClientSession() as session:
-                    headers = {"Authorization": f"Bearer {service.token}"}
+                session = self._get_session(service)
+                
+                # 准备文件
+                with open(image_path, 'rb') as f:
+                    data = aiohttp.FormData()
+                    data.add_field('file',
+                                 f,
+                                 filename=image_path.split('/')[-1])
+                    if regions is not None:
+                        data.add_field('regions', json.dumps(regions))
                     
-                    # 准备文件
-                    with open(image_path, 'rb') as f:
-                        data = aiohttp.FormData()
-                        data.add_field('file',
-                                     f,
-                                     filename=image_path.split('/')[-1])
-                        
-                        async with session.post(
-                            service.url,
-                            data=data,
-                            headers=headers,
-                            timeout=service.timeout
-                        ) as response:
-                            if response.status == 200:
-                                return await response.json()
-                            else:
-                                self.logger.error(
-                                    f"OCR服务 {service.url} {image_path} 返回错误: {response.status}"
-                                )
-                                return None
-                                
+                    async with session.post(service.url, data=data) as response:
+                        if response.status == 200:
+                            return await response.json()
+                        elif response.status == 503:
+                            raise ServiceBusyError(f"OCR服务 {service.url} 繁忙")
+                        else:
+                            self.logger.error(
+                                f"OCR服务 {service.url} {image_path} 返回错误: {response.status}"
+                            )
+                            return None
+
+            except ServiceBusyError:
+                raise
             except Exception as e:
                 self.logger.error(f"调用OCR服务 {service.url} {image_path} 失败: {str(e)}")
                 return None
     
-    async def process_images(self, image_paths: List[str]) -> Dict[str, List[Dict]]:
+    async def _call_batch_service(
+        self,
+        state: ServiceState,
+        image_paths: List[str],
+        queue: asyncio.Queue,
+        regions: Dict[str, List[List[int]]]
+    ):
         """
-        并发处理多张图片，返回图片路径到OCR结果的映射
+        调用OCR服务的批量接口，一次请求发送多张图片，
+        服务端每完成一张返回一行 NDJSON，结果逐张放入队列。
+        批量请求不占用并发信号量，在途数量由调用方控制
         """
-        results = {}
-        tasks = []
-        
-        # 为每张图片创建任务
-        for image_path in image_paths:
-            task = asyncio.create_task(self._process_single_image(image_path))
-            tasks.append((image_path, task))
-            
-        # 等待所有任务完成
-        for image_path, task in tasks:
-            try:
-                result = await task
-                results[image_path] = result
-            except Exception as e:
-                self.logger.error(f"处理图片失败 {image_path}: {str(e)}")
-                results[image_path] = None
-                
-        return results
-    
-    async def _process_single_image(self, image_path: str) -> Optional[List[Dict]]:
+        service = state.service
+        remaining = set(image_paths)
+        completed = 0
+        busy = False
+        start_time = time.monotonic()
+        try:
+            session = self._get_session(service)
+            with contextlib.ExitStack() as stack:
+                data = aiohttp.FormData()
+                for image_path in image_paths:
+                    data.add_field('files',
+                                 stack.enter_context(open(image_path, 'rb')),
+                                 filename=os.path.basename(image_path))
+                if any(image_path in regions for image_path in image_paths):
+                    # 与 files 一一对应，null 表示识别整张图片
+                    data.add_field('regions', json.dumps([regions.get(image_path) for image_path in image_paths]))
+
+                async with session.post(
+                    f"{service.url.rstrip('/')}/batch",
+                    data=data,
+                    # 流式返回，只限制相邻两条结果之间的等待时间
+                    timeout=aiohttp.ClientTimeout(total=None, sock_read=service.timeout)
+                ) as response:
+                    if response.status in (404, 405):
+                        # 旧版本OCR服务没有批量接口，改为逐张调用
+                        self.logger.warning(f"OCR服务 {service.url} 不支持批量接口, 改为逐张处理")
+                        state.supports_batch = False
+                    elif response.status == 503:
+                        busy = True
+                        self.logger.warning(f"OCR服务 {service.url} 繁忙, 稍后重试")
+                    elif response.status != 200:
+                        self.logger.error(f"OCR服务 {service.url} 批量接口返回错误: {response.status}")
+                    else:
+                        async for line in response.content:
+                            if not line.strip():
+                                continue
+                            item = json.loads(line)
+                            image_path = image_paths[item['index']]
+                            if image_path not in remaining:
+                                continue
+                            remaining.discard(image_path)
+                            if item['status'] == 200:
+                                completed += 1
+                                queue.put_nowait((image_path, item['result']))
+                            else:
+                                self.logger.error(
+                                    f"OCR服务 {service.url} {image_path} 处理失败: {item.get('detail')}"
+                                )
+                                queue.put_nowait((image_path, None))
+
+        except Exception as e:
+            self.logger.error(f"调用OCR服务 {service.url} 批量接口失败: {str(e)}")
+
+        if not state.supports_batch:
+            await asyncio.gather(*(self._run_single(state, image_path, queue, regions) for image_path in remaining))
+            return
+
+        if completed:
+            state.record_success((time.monotonic() - start_time) / completed)
+        elif remaining and not busy:
+            self._record_failure(state)
+        for image_path in remaining:
+            queue.put_nowait((image_path, None))
+
+    async def _run_single(
+        self,
+        state: ServiceState,
+        image_path: str,
+        queue: asyncio.Queue,
+        regions: Dict[str, List[List[int]]]
+    ):
+        """逐张调用OCR服务，结果放入队列"""
+        start_time = time.monotonic()
+        try:
+            result = await self._call_single_service(state.service, image_path, regions.get(image_path))
+        except ServiceBusyError as e:
+            # 繁忙不是故障，不计入熔断，换一个服务重试
+            self.logger.warning(f"{str(e)}, 稍后重试 {image_path}")
+            queue.put_nowait((image_path, None))
+            return
+        if result is not None:
+            # 单张接口可同时处理 OCR_CONCURRENT_LIMIT 张，折算为每张的平均耗时
+            state.record_success((time.monotonic() - start_time) / settings.OCR_CONCURRENT_LIMIT)
+        else:
+            self._record_failure(state)
+        queue.put_nowait((image_path, result))
+
+    async def _lookup_cached(
+        self,
+        state: ServiceState,
+        image_paths: List[str],
+        queue: asyncio.Queue,
+        regions: Dict[str, List[List[int]]]
+    ) -> List[str]:
         """
-        处理单张图片，每次处理直接轮换使用不同的OCR服务
+        上传前先按图片内容的 SHA-256 查询服务端的结果缓存，命中的结果直接放入队列，
+        返回仍需上传的图片。查询失败时全部上传
         """
-        services_count = len(settings.OCR_SERVICES)
-        if services_count == 0:
-            self.logger.error("没有可用的OCR服务")
+        service = state.service
+        try:
+            hashes = await asyncio.to_thread(lambda: [_file_hash(image_path) for image_path in image_paths])
+            session = self._get_session(service)
+            payload = {
+                "items": [
+                    {"hash": digest, "regions": regions.get(image_path)}
+                    for image_path, digest in zip(image_paths, hashes)
+                ]
+            }
+            async with session.post(f"{service.url.rstrip('/')}/lookup", json=payload) as response:
+                if response.status in (404, 405):
+                    # 旧版本OCR服务没有结果缓存
+                    self.logger.warning(f"OCR服务 {service.url} 不支持结果缓存查询, 直接上传")
+                    state.supports_lookup = False
+                    return image_paths
+                if response.status != 200:
+                    self.logger.warning(f"OCR服务 {service.url} 结果缓存查询返回错误: {response.status}")
+                    return image_paths
+                results = (await response.json())['results']
+        except Exception as e:
+            self.logger.warning(f"查询OCR服务 {service.url} 结果缓存失败: {str(e)}")
+            return image_paths
+
+        misses = []
+        for image_path, result in zip(image_paths, results):
+            if result is None:
+                misses.append(image_path)
+            else:
+                queue.put_nowait((image_path, result))
+        if len(misses) < len(image_paths):
+            self.logger.info(f"OCR服务 {service.url} 结果缓存命中 {len(image_paths) - len(misses)}/{len(image_paths)} 张")
+        return misses
+
+    async def _dispatch_batch(
+        self,
+        state: ServiceState,
+        image_paths: List[str],
+        queue: asyncio.Queue,
+        regions: Dict[str, List[List[int]]]
+    ):
+        """先查询结果缓存，再上传未命中的图片"""
+        if settings.OCR_HASH_LOOKUP and state.supports_lookup:
+            image_paths = await self._lookup_cached(state, image_paths, queue, regions)
+        if not image_paths:
+            return
+        if state.supports_batch:
+            await self._call_batch_service(state, image_paths, queue, regions)
+        else:
+            await asyncio.gather(*(self._run_single(state, image_path, queue, regions) for image_path in image_paths))
+
+    async def _dispatch(
+        self,
+        state: ServiceState,
+        image_paths: List[str],
+        queue: asyncio.Queue,
+        regions: Dict[str, List[List[int]]]
+    ):
+        """把分配给同一个服务的图片按批发送"""
+        batch_size = settings.OCR_BATCH_SIZE
+        await asyncio.gather(*(
+            self._dispatch_batch(state, image_paths[i:i + batch_size], queue, regions)
+            for i in range(0, len(image_paths), batch_size)
+        ))
+
+    def _record_failure(self, state: ServiceState):
+        cooldown = state.record_failure()
+        if cooldown is not None:
+            self.logger.warning(
+                f"OCR服务 {state.service.url} 连续失败 {state.consecutive_failures} 次, 熔断 {cooldown} 秒"
+            )
+
+    def _select_service(self, tried: Set[str]) -> Optional[ServiceState]:
+        """选择未熔断且负载最低的服务，优先选择本张图片还未尝试过的服务"""
+        now = time.monotonic()
+        available = [state for state in self._states.values() if state.is_available(now)]
+        candidates = [state for state in available if state.service.url not in tried] or available
+        if not candidates:
             return None
+        return min(candidates, key=lambda state: state.load_score())
 
-        # print(self._current_service_index)
+    async def iter_images(
+        self,
+        image_paths: List[str],
+        regions: Optional[Dict[str, List[List[int]]]] = None
+    ) -> AsyncIterator[Tuple[str, Optional[List[Dict]]]]:
+        """
+        并发处理多张图片，每完成一张返回 (图片路径, OCR结果)，失败时结果为 None。
+        每张图片分配给负载最低的健康服务，失败时换一个服务重试。
+        regions 为 图片路径 -> 识别区域 [[x1, y1, x2, y2], ...]，未列出的图片识别整张
+        """
+        regions = regions or {}
+        if not self._states:
+            self.logger.error("没有可用的OCR服务")
+            for image_path in image_paths:
+                yield image_path, None
+            return
 
-        # 获取当前服务并更新索引
-        service = settings.OCR_SERVICES[self._current_service_index]
-        self._current_service_index = (self._current_service_index + 1) % services_count
-        
-        # 尝试调用服务
-        result = await self._call_single_service(service, image_path)
-        if result is not None:
-            return result
-            
-        # self.logger.error(f"本次OCR服务调用失败, 跳过, service: {service.url}")
-        return None 
\ No newline at end of file
+        max_retries = max(state.service.max_retries for state in self._states.values())
+        tried: Dict[str, Set[str]] = {image_path: set() for image_path in image_paths}
+        attempts: Dict[str, int] = {image_path: 0 for image_path in image_paths}
+        queue: asyncio.Queue = asyncio.Queue()
+        tasks: Set[asyncio.Task] = set()
+        unfinished: Dict[str, ServiceState] = {}  # 结果尚未取回的图片 -> 分配的服务
+
+        def dispatch(paths: List[str]):
+            assignments: Dict[str, List[str]] = {}
+            for image_path in paths:
+                state = self._select_service(tried[image_path])
+                if state is None:
+                    self.logger.error(f"所有OCR服务均已熔断, 跳过 {image_path}")
+                    attempts[image_path] = max_retries
+                    queue.put_nowait((image_path, None))
+                    continue
+                tried[image_path].add(state.service.url)
+                # 分配时即计入负载，让同一批中后续图片分散到其他服务
+                state.in_flight += 1
+                unfinished[image_path] = state
+                assignments.setdefault(state.service.url, []).append(image_path)
+
+            for url, assigned in assignments.items():
+                task = asyncio.create_task(self._dispatch(self._states[url], assigned, queue, regions))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+        dispatch(list(image_paths))
+        pending = len(image_paths)
+        try:
+            while pending:
+                image_path, result = await queue.get()
+                state = unfinished.pop(image_path, None)
+                if state is not None:
+                    state.in_flight -= 1
+                if result is None and attempts[image_path] < max_retries:
+                    attempts[image_path] += 1
+                    self.logger.info(f"OCR处理失败, 第 {attempts[image_path]} 次重试 {image_path}")
+                    dispatch([image_path])
+                    continue
+                pending -= 1
+                yield image_path, result
+        finally:
+            for task in tasks:
+                task.cancel()
+            # 提前结束（调用方被取消或不再迭代）时，未取回结果的图片不再计入服务负载
+            for state in unfinished.values():
+                state.in_flight -= 1
+
+    async def process_images(self, image_paths: List[str]) -> Dict[str, List[Dict]]:
+        """
+        并发处理多张图片，返回图片路径到OCR结果的映射
+        """
+        results = {}
+        async for image_path, result in self.iter_images(image_paths):
+            results[image_path] = result
+        return results
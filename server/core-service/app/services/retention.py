@@ -0,0 +1,335 @@
+"""
+截图存储保留策略，按截图时间分三个阶段逐步压缩旧截图：
+
+1. 超过 RETENTION_REENCODE_DAYS 天：降低质量/分辨率重新编码
+2. 超过 RETENTION_THUMBNAIL_DAYS 天：只保留缩略图，OCR文字和词嵌入仍可搜索
+3. 超过 RETENTION_DELETE_DAYS 天：标记 deleted_at 并删除文件
+
+天数为 0 表示不启用该阶段。每批最多处理 RETENTION_BATCH_SIZE 张。
+压缩阶段的文件处理在加锁之前完成，写入数据库时才用 FOR UPDATE SKIP LOCKED 锁定，
+并确认记录在此期间没有被其他进程修改。删除阶段先标记 deleted_at、提交后再删除文件；
+重复截图与原图共用文件，原图在所有重复截图都过期前不会删除，文件随原图删除。手动执行一次：
+    python -m app.services.retention
+"""
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+from PIL import Image as PILImage
+from sqlalchemy import select, update, func, tuple_, bindparam, exists
+from sqlalchemy.orm import aliased
+from app.core.config import settings
+from app.db.database import SessionLocal
+from app.models.image import Image
+from app.services import thumbnails
+
+logger = logging.getLogger(__name__)
+
+# Image.storage_tier 的取值
+TIER_ORIGINAL = 0
+TIER_REENCODED = 1
+TIER_THUMBNAIL = 2
+
+@dataclass
+class StageStats:
+    images: int = 0
+    reclaimed_bytes: int = 0
+
+def _reencode(relative_path: str, max_width: int, quality: int) -> Tuple[str, int]:
+    """
+    按最大宽度和质量重新编码为 WebP，返回 (新的相对路径, 减少的字节数)。
+    新文件写入同名的 .webp 路径，原文件由调用方在数据库更新后删除；
+    新文件不比原文件小时保留原文件，返回原路径
+    """
+    path = os.path.join(settings.UPLOAD_DIR, relative_path)
+    if not os.path.exists(path):
+        return relative_path, 0
+    original_size = os.path.getsize(path)
+    with PILImage.open(path) as image:
+        image.load()
+        if image.width > max_width:
+            height = max(1, round(image.height * max_width / image.width))
+            image = image.resize((max_width, height), PILImage.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, format="WEBP", quality=quality)
+    if buffer.tell() >= original_size:
+        return relative_path, 0
+    stem, _ = os.path.splitext(relative_path)
+    target = f"{stem}.webp"
+    target_path = os.path.join(settings.UPLOAD_DIR, target)
+    temp_path = f"{target_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(buffer.getvalue())
+    os.replace(temp_path, target_path)
+    return target, original_size - buffer.tell()
+
+def _delete_file(path: str) -> int:
+    """删除文件，目录为空时一并删除，返回释放的字节数"""
+    if not os.path.exists(path):
+        return 0
+    size = os.path.getsize(path)
+    os.remove(path)
+    directory = os.path.dirname(path)
+    try:
+        os.rmdir(directory)
+    except OSError:
+        pass  # 目录中还有其他文件
+    return size
+
+def _has_live_duplicates(cutoff: datetime):
+    """原图还有未过期（截图时间不早于 cutoff）的重复截图，这些记录仍在使用原图的文件"""
+    duplicate = aliased(Image)
+    return (
+        exists()
+        .where(duplicate.duplicate_of == Image.id)
+        .where(duplicate.deleted_at == None)
+        .where(duplicate.captured_at >= cutoff)
+    )
+
+class RetentionEngine:
+    def __init__(self):
+        # 图片编码是 CPU 密集操作，单线程执行，不和上传、分词抢占 CPU
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retention")
+        self._task: Optional[asyncio.Task] = None
+
+    def _stages(self, now: datetime) -> List[tuple]:
+        """(阶段名, 目标层级, 截止时间)，按从旧到新的顺序处理"""
+        stages = []
+        if settings.RETENTION_DELETE_DAYS > 0:
+            stages.append(("delete", None, now - timedelta(days=settings.RETENTION_DELETE_DAYS)))
+        if settings.RETENTION_THUMBNAIL_DAYS > 0:
+            stages.append(("thumbnail", TIER_THUMBNAIL, now - timedelta(days=settings.RETENTION_THUMBNAIL_DAYS)))
+        if settings.RETENTION_REENCODE_DAYS > 0:
+            stages.append(("reencode", TIER_REENCODED, now - timedelta(days=settings.RETENTION_REENCODE_DAYS)))
+        return stages
+
+    def _process_file(self, stage: str, relative_path: str) -> Tuple[Optional[str], int]:
+        """处理图片文件，返回 (处理后的相对路径, 释放的字节数)，删除阶段路径为 None"""
+        if stage == "delete":
+            thumbnails.remove_thumbnails(relative_path)
+            return None, _delete_file(os.path.join(settings.UPLOAD_DIR, relative_path))
+        if stage == "thumbnail":
+            return _reencode(relative_path, settings.RETENTION_THUMBNAIL_WIDTH, settings.RETENTION_THUMBNAIL_QUALITY)
+        return _reencode(relative_path, settings.RETENTION_REENCODE_MAX_WIDTH, settings.RETENTION_REENCODE_QUALITY)
+
+    def _remove_files(self, relative_paths: List[str]):
+        """删除已被 .webp 文件替换的原文件，或未被使用的新文件"""
+        for relative_path in relative_paths:
+            try:
+                os.remove(os.path.join(settings.UPLOAD_DIR, relative_path))
+            except FileNotFoundError:
+                pass
+
+    async def _run_batch(self, stage: str, tier: Optional[int], cutoff: datetime) -> Tuple[StageStats, int]:
+        """
+        处理一批图片，返回统计和取出的数量。
+        先不加锁地取出一批并处理文件，再锁定记录，只更新处理期间未被修改的记录
+        """
+        stats = StageStats()
+        loop = asyncio.get_running_loop()
+        stmt = (
+            select(Image.id, Image.captured_at, Image.file_path, Image.storage_tier)
+            .where(Image.deleted_at == None)
+            .where(Image.captured_at < cutoff)
+            .order_by(Image.captured_at)
+            .limit(settings.RETENTION_BATCH_SIZE)
+        )
+        if tier is None:
+            # 删除阶段处理所有层级，重复截图还在使用的原图留到重复截图过期后再删除
+            stmt = stmt.where(Image.storage_tier.in_([TIER_ORIGINAL, TIER_REENCODED, TIER_THUMBNAIL]))
+            stmt = stmt.where(~_has_live_duplicates(cutoff))
+        else:
+            # 未完成OCR的图片先不压缩，避免影响识别结果
+            stmt = stmt.where(Image.storage_tier.in_(list(range(tier)))).where(Image.ocr_completed == True)
+            # 重复截图和原图共用文件，只随原图压缩
+            stmt = stmt.where(Image.duplicate_of == None)
+        async with SessionLocal() as db:
+            rows = (await db.execute(stmt)).all()
+        if not rows:
+            return stats, 0
+
+        if stage == "delete":
+            return await self._delete_batch(rows, cutoff), len(rows)
+
+        # (id, captured_at) -> (取出时的记录, 处理后的相对路径, 释放的字节数)
+        done = {}
+        for row in rows:
+            try:
+                new_path, reclaimed = await loop.run_in_executor(
+                    self._executor, self._process_file, stage, row.file_path
+                )
+                done[(row.id, row.captured_at)] = (row, new_path, reclaimed)
+            except Exception as e:
+                logger.error(f"处理图片 {row.file_path} 失败: {str(e)}")
+                # 无法解码的图片重试也不会成功，照常更新层级
+                done[(row.id, row.captured_at)] = (row, row.file_path, 0)
+
+        images = Image.__table__
+        async with SessionLocal() as db:
+            current = (await db.execute(
+                select(Image.id, Image.captured_at, Image.file_path, Image.storage_tier, Image.deleted_at)
+                .where(tuple_(Image.id, Image.captured_at).in_(list(done)))
+                .with_for_update(skip_locked=True)
+            )).all()
+            # 其他进程已处理的记录不再更新；正在处理（已锁定）的记录不在结果中，新文件可能被对方使用，保留
+            unchanged = []
+            abandoned = []
+            for row in current:
+                item = done[(row.id, row.captured_at)]
+                if row.deleted_at is None and (row.file_path, row.storage_tier) == (item[0].file_path, item[0].storage_tier):
+                    unchanged.append(item)
+                elif item[1] not in (item[0].file_path, row.file_path):
+                    # 记录在处理期间被修改，新写入的文件不会被使用
+                    abandoned.append(item[1])
+            if unchanged:
+                params = [
+                    {
+                        "image_id": row.id,
+                        "image_captured_at": row.captured_at,
+                        "old_path": row.file_path,
+                        "new_path": new_path,
+                        "new_extension": os.path.splitext(new_path)[1][1:],
+                    }
+                    for row, new_path, _ in unchanged
+                ]
+                await db.execute(
+                    update(images)
+                    .where(images.c.id == bindparam("image_id"))
+                    .where(images.c.captured_at == bindparam("image_captured_at"))
+                    .values(
+                        storage_tier=tier,
+                        file_path=bindparam("new_path"),
+                        file_extension=bindparam("new_extension")
+                    ),
+                    params
+                )
+                # 重复截图与原图共用文件，路径随原图更新
+                renamed = [item for item in params if item["new_path"] != item["old_path"]]
+                if renamed:
+                    await db.execute(
+                        update(images)
+                        .where(images.c.duplicate_of == bindparam("image_id"))
+                        .where(images.c.file_path == bindparam("old_path"))
+                        .values(file_path=bindparam("new_path"), file_extension=bindparam("new_extension")),
+                        renamed
+                    )
+            await db.commit()
+
+        # 数据库已指向新文件后才删除原文件
+        removed = [row.file_path for row, new_path, _ in unchanged if new_path != row.file_path] + abandoned
+        if removed:
+            await loop.run_in_executor(self._executor, self._remove_files, removed)
+        stats.images = len(unchanged)
+        stats.reclaimed_bytes = sum(reclaimed for _, _, reclaimed in unchanged)
+        return stats, len(rows)
+
+    async def _delete_batch(self, rows: list, cutoff: datetime) -> StageStats:
+        """
+        删除阶段：先在一个事务中标记 deleted_at，提交后再删除文件和缩略图。
+        加锁后再次确认原图没有未过期的重复截图（检查之后可能有新上传的重复截图）；
+        已过期的重复截图随原图一起标记，文件只随原图删除
+        """
+        stats = StageStats()
+        loop = asyncio.get_running_loop()
+        keys = [(row.id, row.captured_at) for row in rows]
+        async with SessionLocal() as db:
+            locked = (await db.execute(
+                select(Image.id, Image.captured_at)
+                .where(tuple_(Image.id, Image.captured_at).in_(keys))
+                .where(Image.deleted_at == None)
+                .with_for_update(skip_locked=True)
+            )).all()
+            if not locked:
+                return stats
+            deleted = (await db.execute(
+                update(Image)
+                .where(tuple_(Image.id, Image.captured_at).in_([tuple(row) for row in locked]))
+                .where(~_has_live_duplicates(cutoff))
+                .values(deleted_at=func.now())
+                .returning(Image.id, Image.file_path, Image.duplicate_of)
+                .execution_options(synchronize_session=False)
+            )).all()
+            originals = [row for row in deleted if row.duplicate_of is None]
+            if originals:
+                # 本批之外已过期的重复截图，避免指向已删除的文件
+                result = await db.execute(
+                    update(Image)
+                    .where(Image.duplicate_of.in_([row.id for row in originals]))
+                    .where(Image.captured_at < cutoff)
+                    .where(Image.deleted_at == None)
+                    .values(deleted_at=func.now())
+                    .execution_options(synchronize_session=False)
+                )
+                stats.images += result.rowcount
+            await db.commit()
+        stats.images += len(deleted)
+
+        for row in originals:
+            try:
+                _, reclaimed = await loop.run_in_executor(self._executor, self._process_file, "delete", row.file_path)
+                stats.reclaimed_bytes += reclaimed
+            except Exception as e:
+                logger.error(f"删除图片 {row.file_path} 失败: {str(e)}")
+        return stats
+
+    async def run_once(self, max_batches: Optional[int] = None) -> Dict[str, StageStats]:
+        """
+        执行一轮保留策略。每个阶段按批处理，直到没有待处理图片或达到 max_batches
+        """
+        max_batches = max_batches or settings.RETENTION_MAX_BATCHES
+        report: Dict[str, StageStats] = {}
+        for stage, tier, cutoff in self._stages(datetime.now()):
+            total = StageStats()
+            for _ in range(max_batches):
+                stats, fetched = await self._run_batch(stage, tier, cutoff)
+                total.images += stats.images
+                total.reclaimed_bytes += stats.reclaimed_bytes
+                if fetched < settings.RETENTION_BATCH_SIZE or not stats.images:
+                    break
+            report[stage] = total
+            if total.images:
+                logger.info(
+                    f"保留策略 {stage}: 处理 {total.images} 张图片, "
+                    f"释放 {total.reclaimed_bytes / 1024 / 1024:.1f} MB"
+                )
+        return report
+
+    async def _run_loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"执行保留策略失败: {str(e)}")
+            await asyncio.sleep(settings.RETENTION_INTERVAL)
+
+    def start(self):
+        if self._task is None and self._stages(datetime.now()):
+            self._task = asyncio.create_task(self._run_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+retention_engine = RetentionEngine()
+
+if __name__ == "__main__":
+    async def _main():
+        from app.db.database import engine
+        try:
+            report = await retention_engine.run_once(max_batches=1_000_000)
+        finally:
+            await engine.dispose()
+        for stage, stats in report.items():
+            print(f"{stage}: {stats.images} 张, 释放 {stats.reclaimed_bytes} 字节")
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_main())
@@ -1,161 +1,633 @@
 import time
-from typing import List, Optional, Tuple
+import socket
+import uuid
+from datetime import timedelta
+from typing import Dict, List, Optional, Set, Tuple
 import logging
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from app.db.database import SessionLocal
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, func, select, update, text, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.db.database import SessionLocal, engine
 from app.models.image import Image
 from app.models.image_ocr import ImageOCR
+from app.models.image_embedding import ImageEmbedding
 from app.core.config import settings
 import threading
 import backoff  # 需要安装这个包用于重试机制
 import asyncio
-import jieba
+import contextlib
+import asyncpg
 import os
 import json
 from app.services.ocr_client import OCRClient
+from app.services import tokenizer, incremental_ocr
+from app.services.embedding_processor import embedding_processor, build_embedding_text
+
+def build_ocr_summary(ocr_metadata: dict) -> dict:
+    """构建搜索结果使用的精简 OCR 数据：去掉 position，confidence 转为百分制"""
+    return {
+        **ocr_metadata,
+        "ocr_result": [
+            {
+                "text": item.get('text'),
+                "confidence": round(item['confidence'] * 100) if 'confidence' in item else None
+            }
+            for item in ocr_metadata.get("ocr_result") or []
+        ]
+    }
+
+async def notify_new_images(db: AsyncSession):
+    """
+    在上传事务中发送 NOTIFY，事务提交后所有 core-service 进程的调度器都会被唤醒
+    """
+    await db.execute(text("SELECT pg_notify(:channel, '')"), {"channel": settings.IMAGE_NOTIFY_CHANNEL})
 
 class OCRScheduler:
-    def __init__(self, batch_size: int = 5):
-        self.batch_size = batch_size
+    """
+    OCR处理流水线：
+    - 生产者按剩余在途容量从数据库认领待处理图片（FOR UPDATE SKIP LOCKED + 租约），分配给OCR服务
+    - 每张图片OCR完成后立即放入写入队列并释放一个在途名额，生产者随即补充新图片
+    - 写入任务把队列中已完成的结果合并成一个事务保存
+    - 保存后的图片进入词嵌入队列，按 EMBEDDING_BATCH_SIZE 批量推理并写入 t_image_embeddings
+    - 处理中的图片定期续约；进程退出或宕机后租约过期，图片会被其他调度器重新认领
+    """
+    def __init__(self):
         self.logger = logging.getLogger(__name__)
         self.ocr_client = OCRClient()  # 使用新的OCR客户端
         self._running = False
-        self._current_delay = 10  # 添加初始延迟时间
-        self._max_delay = 600     # 最大延迟时间（10分钟）
-        
-        # 初始化jieba分词设置
-        jieba.initialize()
-
-    def _get_pending_images(self, db: Session, limit: Optional[int] = None):
-        """查询所有未完成的任务"""
-        query = db.query(Image).filter(
-            (Image.ocr_completed == False) | 
-            (Image.embedding_completed == False)
-        ).order_by(Image.created_at.asc())
+        self._task: Optional[asyncio.Task] = None
+        self._retry_delay = 10    # 失败图片的初始重试间隔（秒）
+        self._max_delay = 600     # 最大重试间隔（10分钟）
+        self._idle_interval = 10  # 未监听到通知时的兜底轮询间隔（秒）
+        self._listening = False  # 是否已通过 LISTEN 订阅新图片通知
         
-        if limit:
-            query = query.limit(limit)
-            
-        return query.all()
+        # 在途窗口：每个OCR服务保持 OCR_PIPELINE_DEPTH 张图片在处理中
+        self.window_size = max(1, settings.OCR_PIPELINE_DEPTH * len(settings.OCR_SERVICES))
+        self._in_flight: Set[int] = set()  # 已认领但结果尚未保存的图片ID
+        self._failures: Dict[int, int] = {}  # 图片ID -> 连续失败次数
+        self._retry_at: Dict[int, float] = {}  # 图片ID -> 允许重试的时间，用于计算下次唤醒
+        # 调度器实例标识，多个进程/主机通过它区分各自认领的图片
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._lease = timedelta(seconds=settings.OCR_LEASE_SECONDS)
+        self._wakeup = asyncio.Event()  # 有新上传或在途名额释放时唤醒生产者
+        self._write_queue: asyncio.Queue = asyncio.Queue()
+        self._embedding: Set[int] = set()  # OCR已保存、等待生成词嵌入的图片ID
+        self._embed_queue: asyncio.Queue = asyncio.Queue()  # (图片ID, 嵌入文本)
+        self._workers: Set[asyncio.Task] = set()
+
+    def wake(self):
+        """有新图片上传时调用，立即唤醒调度器"""
+        self._wakeup.set()
+
+    async def _listen_loop(self):
+        """
+        使用独立连接 LISTEN 新图片通知，连接断开后自动重连
+        """
+        dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+        channel = settings.IMAGE_NOTIFY_CHANNEL
+        while self._running:
+            conn = None
+            try:
+                conn = await asyncpg.connect(dsn)
+                closed = asyncio.Event()
+                conn.add_termination_listener(lambda _: closed.set())
+                await conn.add_listener(channel, lambda *_: self.wake())
+                self._listening = True
+                self.logger.info(f"已订阅新图片通知: {channel}")
+                while not closed.is_set():
+                    try:
+                        await asyncio.wait_for(closed.wait(), timeout=60)
+                    except asyncio.TimeoutError:
+                        # 定期检测连接是否仍然可用
+                        await conn.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.warning(f"订阅新图片通知失败, 使用轮询兜底: {str(e)}")
+            finally:
+                self._listening = False
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            # 重连前唤醒一次，补上断线期间可能漏掉的通知
+            self.wake()
+            await asyncio.sleep(5)
+
+    async def _claim_pending_images(self, db: AsyncSession, limit: int) -> List[Image]:
+        """
+        认领待处理图片：跳过其他调度器已锁定或租约未过期的图片，
+        租约过期的图片（认领者已退出）会被重新认领
+        """
+        pending = (
+            select(Image.id)
+            .where(
+                (Image.ocr_completed == False) | 
+                (Image.embedding_completed == False)
+            )
+            .where((Image.lease_expires_at == None) | (Image.lease_expires_at < func.now()))
+            .where(Image.deleted_at == None)
+            .order_by(Image.created_at.asc())
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = (
+            update(Image)
+            .where(Image.id.in_(pending.scalar_subquery()))
+            .values(claimed_by=self.worker_id, lease_expires_at=func.now() + self._lease)
+            .returning(Image)
+            .execution_options(synchronize_session=False)
+        )
+        images = (await db.scalars(stmt)).all()
+        await db.commit()
+        return images
 
-    async def _process_batch(self, db: Session, images: List[Image]):
-        """处理一批图片"""
-        successful_ocr_count = 0
+    async def _release_failed(self, image_ids: List[int], reason: str = "OCR失败"):
+        """
+        释放失败图片的租约，并把租约到期时间设为下次重试时间（随失败次数递增），
+        所有调度器都会在此之前跳过这些图片
+        """
+        params = []
+        for image_id in image_ids:
+            failures = self._failures.get(image_id, 0) + 1
+            self._failures[image_id] = failures
+            delay = min(self._retry_delay * failures, self._max_delay)
+            self._retry_at[image_id] = time.monotonic() + delay
+            params.append({"image_id": image_id, "delay": delay})
+            self.logger.warning(f"图片 {image_id} {reason} {failures} 次，{delay}秒后重试")
+
+        images = Image.__table__
+        try:
+            async with SessionLocal() as db:
+                await db.execute(
+                    update(images)
+                    .where(images.c.id == bindparam("image_id"))
+                    .where(images.c.claimed_by == self.worker_id)
+                    .values(
+                        claimed_by=None,
+                        lease_expires_at=func.now() + func.make_interval(0, 0, 0, 0, 0, 0, bindparam("delay"))
+                    ),
+                    params
+                )
+                await db.commit()
+        except Exception as e:
+            self.logger.error(f"释放失败图片租约出错: {str(e)}")
+
+    async def _release_leases(self):
+        """释放本调度器持有的全部租约（停止时调用）"""
+        async with SessionLocal() as db:
+            await db.execute(
+                update(Image)
+                .where(Image.claimed_by == self.worker_id)
+                .values(claimed_by=None, lease_expires_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+
+    async def _heartbeat_loop(self):
+        """定期为处理中的图片续约"""
+        interval = max(1, settings.OCR_LEASE_SECONDS // 3)
+        while True:
+            await asyncio.sleep(interval)
+            image_ids = list(self._in_flight | self._embedding)
+            if not image_ids:
+                continue
+            try:
+                async with SessionLocal() as db:
+                    await db.execute(
+                        update(Image)
+                        .where(Image.id.in_(image_ids))
+                        .where(Image.claimed_by == self.worker_id)
+                        .values(lease_expires_at=func.now() + self._lease)
+                        .execution_options(synchronize_session=False)
+                    )
+                    await db.commit()
+            except Exception as e:
+                self.logger.error(f"续约失败: {str(e)}")
+
+    def _build_ocr_record(self, image: Image, results: List[Dict]) -> Tuple[dict, str]:
+        """构建OCR元数据和待分词的搜索文本"""
+        # 构建结构化的JSON数据
+        ocr_metadata = {
+            "timestamp": image.captured_at.strftime('%Y-%m-%d %H:%M:%S'),
+            "active_app": image.app_name or '',
+            "window_title": image.window_title or '',
+            "ocr_result": results
+        }
         
-        # 收集需要处理OCR的图片路径
-        ocr_tasks = []
-        for image in images:
-            if not image.ocr_completed:
-                image_path = f"{settings.UPLOAD_DIR}/{image.file_path}"
-                ocr_tasks.append((image, image_path))
+        # 添加多个关键词以支持更灵活的搜索
+        # 每个文本块单独一行，分词时按行缓存，重复出现的界面文字可以直接命中
+        ocr_text = "\n".join([item['text'] for item in results]) if results else "Blank image Empty No text  /  空白图片 空 无内容 无文本"
         
-        if ocr_tasks:
-            # 批量处理OCR
-            image_paths = [t[1] for t in ocr_tasks]
-            ocr_results = await self.ocr_client.process_images(image_paths)
-            
-            # 处理OCR结果
-            for image, image_path in ocr_tasks:
-                results = ocr_results.get(image_path)
-                if results is not None:
-                    try:
-                        # 构建结构化的JSON数据
-                        ocr_metadata = {
-                            "timestamp": image.captured_at.strftime('%Y-%m-%d %H:%M:%S'),
-                            "active_app": image.app_name or '',
-                            "window_title": image.window_title or '',
-                            "ocr_result": results
-                        }
-                        
-                        # 添加多个关键词以支持更灵活的搜索
-                        ocr_text = " ".join([item['text'] for item in results]) if results else "Blank image Empty No text  /  空白图片 空 无内容 无文本"
-                        
-                        # 构建搜索文本并分词
-                        search_text = "\n".join([
-                            f"timestamp: {ocr_metadata['timestamp']}",
-                            f"active_app: {ocr_metadata['active_app']}",
-                            f"window_title: {ocr_metadata['window_title']}",
-                            f"ocr_result: {ocr_text}"
-                        ])
-                        search_text_seg = " ".join(jieba.cut_for_search(search_text))
-                        
-                        image_ocr = db.query(ImageOCR).get(image.id)
-                        if not image_ocr:
-                            image_ocr = ImageOCR(id=image.id, ocr_metadata=ocr_metadata)
-                            db.add(image_ocr)
-                        else:
-                            image_ocr.ocr_metadata = ocr_metadata
-                        
-                        image_ocr.search_vector = func.to_tsvector('simple', search_text_seg)
-                        image.ocr_completed = True
-                        successful_ocr_count += 1
-                        
-                    except Exception as e:
-                        self.logger.error(f"处理OCR结果失败 {image.id}: {str(e)}")
-                        continue
-            
-            db.commit()
+        # 构建搜索文本
+        search_text = "\n".join([
+            f"timestamp: {ocr_metadata['timestamp']}",
+            f"active_app: {ocr_metadata['active_app']}",
+            f"window_title: {ocr_metadata['window_title']}",
+            f"ocr_result: {ocr_text}"
+        ])
+        return ocr_metadata, search_text
+
+    async def _segment(self, texts: List[str]) -> List[str]:
+        """在分词进程池中批量分词"""
+        return await tokenizer.segment(texts)
+
+    async def _save_ocr_results(self, items: List[Tuple[Image, List[Dict]]]) -> int:
+        """
+        在一个事务中保存一组OCR结果：
+        一条 INSERT ... ON CONFLICT DO UPDATE 写入 t_image_ocr，一条 UPDATE 标记 t_images
+        """
+        records = []
+        failed_ids = []
+        for image, results in items:
+            try:
+                records.append((image, *self._build_ocr_record(image, results)))
+            except Exception as e:
+                self.logger.error(f"处理OCR结果失败 {image.id}: {str(e)}")
+                failed_ids.append(image.id)
 
-        # 处理词嵌入任务
+        # 整批一次性分词
+        search_texts_seg = await self._segment([search_text for _, _, search_text in records])
+        rows = [
+            {
+                "id": image.id,
+                "captured_at": image.captured_at,
+                "ocr_metadata": ocr_metadata,
+                "ocr_summary": build_ocr_summary(ocr_metadata),
+                "search_vector": func.to_tsvector('simple', search_text_seg),
+            }
+            for (image, ocr_metadata, _), search_text_seg in zip(records, search_texts_seg)
+        ]
+        saved_ids = [row["id"] for row in rows]
+
+        if rows:
+            async with SessionLocal() as db:
+                stmt = pg_insert(ImageOCR).values(rows)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[ImageOCR.id, ImageOCR.captured_at],
+                    set_={
+                        "ocr_metadata": stmt.excluded.ocr_metadata,
+                        "ocr_summary": stmt.excluded.ocr_summary,
+                        "search_vector": stmt.excluded.search_vector,
+                    }
+                )
+                await db.execute(stmt)
+
+                if settings.EMBEDDING_ENABLED:
+                    # 继续持有租约，生成词嵌入后再释放
+                    values = dict(ocr_completed=True)
+                else:
+                    values = dict(ocr_completed=True, embedding_completed=True, claimed_by=None, lease_expires_at=None)
+                await db.execute(
+                    update(Image)
+                    .where(Image.id.in_(saved_ids))
+                    .values(**values)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+
+            if settings.EMBEDDING_ENABLED:
+                for image, ocr_metadata, _ in records:
+                    self._enqueue_embedding(image, build_embedding_text(ocr_metadata))
+
+        if failed_ids:
+            await self._release_failed(failed_ids)
+        for image_id in saved_ids:
+            self._failures.pop(image_id, None)
+            self._retry_at.pop(image_id, None)
+        return len(saved_ids)
+
+    def _enqueue_embedding(self, image: Image, text: str):
+        self._embedding.add(image.id)
+        self._embed_queue.put_nowait((image, text))
+
+    async def _complete_embeddings(self, images: List[Image]):
+        """OCR已完成、只差词嵌入的图片：读取已保存的OCR结果放入词嵌入队列"""
+        image_ids = [image.id for image in images]
+        async with SessionLocal() as db:
+            if not settings.EMBEDDING_ENABLED:
+                await db.execute(
+                    update(Image)
+                    .where(Image.id.in_(image_ids))
+                    .values(embedding_completed=True, claimed_by=None, lease_expires_at=None)
+                    .execution_options(synchronize_session=False)
+                )
+                await db.commit()
+                return
+            rows = (await db.execute(
+                select(ImageOCR.id, ImageOCR.ocr_metadata).where(ImageOCR.id.in_(image_ids))
+            )).all()
+        ocr_metadata = {row.id: row.ocr_metadata or {} for row in rows}
         for image in images:
-            if not image.embedding_completed:
-                image.embedding_completed = True
-                
-        db.commit()
-        
-        return successful_ocr_count
+            self._enqueue_embedding(image, build_embedding_text(ocr_metadata.get(image.id, {})))
+
+    async def _save_embeddings(self, items: List[Tuple[Image, str]]):
+        """批量推理并在一个事务中写入词嵌入"""
+        embeddings = await embedding_processor.embed([text or " " for _, text in items])
+        rows = [
+            {"id": image.id, "captured_at": image.captured_at, "text_embedding": embedding}
+            for (image, _), embedding in zip(items, embeddings)
+        ]
+        async with SessionLocal() as db:
+            stmt = pg_insert(ImageEmbedding).values(rows)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ImageEmbedding.id, ImageEmbedding.captured_at],
+                set_={"text_embedding": stmt.excluded.text_embedding}
+            )
+            await db.execute(stmt)
+            await db.execute(
+                update(Image)
+                .where(Image.id.in_([image.id for image, _ in items]))
+                .values(embedding_completed=True, claimed_by=None, lease_expires_at=None)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        for image, _ in items:
+            self._failures.pop(image.id, None)
+            self._retry_at.pop(image.id, None)
+
+    async def _embed_loop(self):
+        """合并等待中的图片，按批生成词嵌入"""
+        while True:
+            items = [await self._embed_queue.get()]
+            while not self._embed_queue.empty() and len(items) < settings.EMBEDDING_BATCH_SIZE:
+                items.append(self._embed_queue.get_nowait())
 
-    async def process_pending_images(self) -> Tuple[int, int]:
-        """处理待处理的图片"""
-        db = SessionLocal()
+            start_time = time.time()
+            try:
+                await self._save_embeddings(items)
+                self.logger.info(f"生成 {len(items)} 张图片的词嵌入, 耗时: {time.time() - start_time:.2f}秒")
+            except Exception as e:
+                self.logger.error(f"生成词嵌入失败: {str(e)}")
+                await self._release_failed([image.id for image, _ in items])
+            finally:
+                for image, _ in items:
+                    self._embedding.discard(image.id)
+                self._wakeup.set()
+
+    async def _find_bases(self, images: List[Image]) -> Dict[tuple, incremental_ocr.BaseFrame]:
+        """每个窗口在本批最早一张之前、数据库中已完成OCR的上一帧"""
+        firsts: Dict[tuple, Image] = {}
+        for image in sorted(images, key=lambda image: image.captured_at):
+            firsts.setdefault(incremental_ocr.group_key(image), image)
+        bases = {}
+        async with SessionLocal() as db:
+            for key, image in firsts.items():
+                try:
+                    base = await incremental_ocr.find_base(db, image)
+                except Exception as e:
+                    self.logger.warning(f"查找增量OCR基准帧失败 {image.id}: {str(e)}")
+                    continue
+                if base is not None:
+                    bases[key] = base
+        return bases
+
+    async def _plan_incremental(
+        self,
+        images: List[Image],
+        bases: Dict[tuple, incremental_ocr.BaseFrame]
+    ) -> Dict[int, incremental_ocr.Plan]:
+        """
+        并发为一轮图片生成增量识别计划，同一窗口的图片都以该窗口的基准帧比较；
+        没有基准帧、与基准帧间隔过长或变化过大的图片识别整张
+        """
+        window = timedelta(seconds=settings.OCR_INCREMENTAL_WINDOW_SECONDS)
+
+        async def plan(image: Image) -> Optional[incremental_ocr.Plan]:
+            base = bases.get(incremental_ocr.group_key(image))
+            if base is None or image.captured_at - base.captured_at > window:
+                return None
+            try:
+                return await asyncio.to_thread(incremental_ocr.plan, base, image.file_path)
+            except Exception as e:
+                self.logger.warning(f"增量OCR比较失败 {image.id}: {str(e)}")
+                return None
+
+        planned = await asyncio.gather(*(plan(image) for image in images))
+        plans = {image.id: item for image, item in zip(images, planned) if item is not None}
+        if plans:
+            self.logger.info(f"增量OCR: {len(plans)}/{len(images)} 张图片只识别变化区域")
+        return plans
+
+    async def _reuse_duplicates(self, images: List[Image]) -> List[Image]:
+        """
+        重复截图复制原图的OCR结果，写入时仍按自己的截图时间建立搜索数据。
+        原图尚未完成OCR的，按失败图片的递增间隔稍后再处理；原图已删除，
+        或已等待 DEDUP_MAX_WAITS 次且原图仍在失败重试中的，自行识别。返回需要OCR的图片
+        """
+        duplicates = [image for image in images if image.duplicate_of is not None]
+        if not duplicates:
+            return images
+        original_ids = {image.duplicate_of for image in duplicates}
+        async with SessionLocal() as db:
+            rows = (await db.execute(
+                select(ImageOCR.id, ImageOCR.ocr_metadata['ocr_result'].label('ocr_result'))
+                .where(ImageOCR.id.in_(original_ids))
+            )).all()
+            results = {row.id: row.ocr_result or [] for row in rows}
+            # 未删除、尚未完成OCR的原图；未认领且租约在未来的正处于失败后的重试等待中
+            rows = (await db.execute(
+                select(
+                    Image.id,
+                    and_(Image.claimed_by == None, Image.lease_expires_at > func.now()).label('failing')
+                )
+                .where(Image.id.in_(original_ids - set(results)))
+                .where(Image.deleted_at == None)
+            )).all()
+            pending = {row.id for row in rows}
+            failing = {row.id for row in rows if row.failing}
+
+        waiting, own = [], []
+        for image in duplicates:
+            if image.duplicate_of in results:
+                self._write_queue.put_nowait((image, results[image.duplicate_of]))
+            elif image.duplicate_of not in pending or (
+                image.duplicate_of in failing and self._failures.get(image.id, 0) >= settings.DEDUP_MAX_WAITS
+            ):
+                own.append(image)
+            else:
+                waiting.append(image)
+        if own:
+            self.logger.warning(f"{len(own)} 张重复截图的原图无法完成OCR, 改为自行识别")
+        if waiting:
+            await self._release_failed([image.id for image in waiting], reason="等待原图OCR")
+            for image in waiting:
+                self._in_flight.discard(image.id)
+        return [image for image in images if image.duplicate_of is None] + own
+
+    async def _ocr_images(self, images: List[Image]):
+        """
+        OCR一组图片，每完成一张立即交给写入任务。重复截图直接复制原图的结果。
+        开启增量OCR时最多分两轮：同一窗口的图片都以同一基准帧比较，
+        没有基准帧的窗口先识别第一张作为基准
+        """
+        remaining = {image.id: image for image in images}
         try:
-            pending_images = self._get_pending_images(db, limit=self.batch_size)
-            total_images = len(pending_images)
-            if total_images == 0:
-                return 0, 0
-            
-            self.logger.info(f"开始处理 {total_images} 张图片")
-            successful_ocr_count = await self._process_batch(db, pending_images)
-            
-            return total_images, successful_ocr_count
-            
+            images = await self._reuse_duplicates(images)
+            remaining = {image.id: image for image in images}
+            incremental = settings.OCR_INCREMENTAL_ENABLED
+            bases = await self._find_bases(images) if incremental else {}
+            rounds = incremental_ocr.split_rounds(images, bases) if incremental else (images, [])
+            for batch in rounds:
+                plans = await self._plan_incremental(batch, bases) if incremental else {}
+                tasks: Dict[str, Image] = {}
+                regions: Dict[str, List[List[int]]] = {}
+                for image in batch:
+                    plan = plans.get(image.id)
+                    if plan is not None and not plan.regions:
+                        # 画面没有变化，直接沿用上一帧的结果
+                        remaining.pop(image.id)
+                        self._write_queue.put_nowait((image, plan.kept))
+                        continue
+                    image_path = f"{settings.UPLOAD_DIR}/{image.file_path}"
+                    tasks[image_path] = image
+                    if plan is not None:
+                        regions[image_path] = plan.regions
+                if not tasks:
+                    continue
+
+                failed: List[Image] = []
+                async for image_path, results in self.ocr_client.iter_images(list(tasks), regions):
+                    image = tasks.pop(image_path)
+                    if results is None:
+                        # OCR服务不可用时整批都会失败，本轮结束后合并成一次释放
+                        failed.append(image)
+                    else:
+                        remaining.pop(image.id)
+                        plan = plans.get(image.id)
+                        if plan is not None:
+                            results = incremental_ocr.merge(plan, results)
+                        if incremental:
+                            # 没有基准帧的窗口以第一轮识别的图片为第二轮的基准
+                            bases.setdefault(incremental_ocr.group_key(image), incremental_ocr.BaseFrame(
+                                id=image.id, file_path=image.file_path,
+                                captured_at=image.captured_at, ocr_result=results
+                            ))
+                        # 结果保存后才释放在途名额，避免被重复取出
+                        self._write_queue.put_nowait((image, results))
+                if failed:
+                    await self._release_failed([image.id for image in failed])
+                    for image in failed:
+                        remaining.pop(image.id)
+                        self._in_flight.discard(image.id)
+        except Exception as e:
+            self.logger.error(f"OCR处理失败: {str(e)}")
         finally:
-            db.close()
+            # 异常或取消时未返回结果的图片
+            for image in remaining.values():
+                self._in_flight.discard(image.id)
+            self._wakeup.set()
+
+    async def _write_loop(self):
+        """合并写入已完成的OCR结果"""
+        while True:
+            items = [await self._write_queue.get()]
+            while not self._write_queue.empty() and len(items) < settings.OCR_WRITE_BATCH_SIZE:
+                items.append(self._write_queue.get_nowait())
 
-    async def _run_loop(self):
-        """持续运行处理任务"""
-        self.logger.info(f"OCR处理服务启动")
-        while self._running:
             start_time = time.time()
-            total_count, successful_ocr_count = await self.process_pending_images()
-            
-            if total_count == 0:
-                self._current_delay = 10  # 重置延迟时间
-                await asyncio.sleep(10)
-            elif successful_ocr_count == 0:
-                self.logger.warning(f"所有OCR任务均失败，等待{self._current_delay}秒后重试")
-                await asyncio.sleep(self._current_delay)
-                # 增加延迟时间，但不超过最大值
-                self._current_delay = min(self._current_delay + 10, self._max_delay)
-            else:
-                self._current_delay = 10  # 重置延迟时间
-                elapsed_time = time.time() - start_time
-                avg_time = elapsed_time / successful_ocr_count if successful_ocr_count > 0 else 0
+            try:
+                saved_count = await self._save_ocr_results(items)
                 self.logger.info(
-                    f"成功处理 {successful_ocr_count}/{total_count} 张图片, "
-                    f"总耗时: {elapsed_time:.2f}秒, "
-                    f"平均每张: {avg_time:.2f}秒"
+                    f"保存 {saved_count}/{len(items)} 张图片的OCR结果, "
+                    f"耗时: {time.time() - start_time:.2f}秒"
                 )
+            except Exception as e:
+                self.logger.error(f"保存OCR结果失败: {str(e)}")
+                await self._release_failed([image.id for image, _ in items])
+            finally:
+                for image, _ in items:
+                    self._in_flight.discard(image.id)
+                self._wakeup.set()
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._workers.add(task)
+        task.add_done_callback(self._workers.discard)
+        return task
+
+    async def _fill_window(self) -> int:
+        """按剩余在途容量取出待处理图片并分配，返回分配的数量"""
+        # 词嵌入积压超过一批时减少认领，避免推理跟不上时队列无限增长
+        backlog = max(0, len(self._embedding) - settings.EMBEDDING_BATCH_SIZE)
+        free = self.window_size - len(self._in_flight) - backlog
+        if free <= 0:
+            return 0
+
+        async with SessionLocal() as db:
+            pending_images = await self._claim_pending_images(db, limit=free)
+        if not pending_images:
+            return 0
+
+        ocr_images = [image for image in pending_images if not image.ocr_completed]
+        embedding_images = [image for image in pending_images if image.ocr_completed]
+        if embedding_images:
+            await self._complete_embeddings(embedding_images)
+        if ocr_images:
+            self._in_flight.update(image.id for image in ocr_images)
+            self._spawn(self._ocr_images(ocr_images))
+        return len(pending_images)
 
-    def start(self):
+    async def _run_loop(self):
+        """持续运行处理任务"""
+        self.logger.info(f"OCR处理服务启动, 在途窗口: {self.window_size}")
+        self._spawn(self._write_loop())
+        self._spawn(self._embed_loop())
+        self._spawn(self._listen_loop())
+        self._spawn(self._heartbeat_loop())
+        while self._running:
+            # 先清除事件再查询，查询期间到达的通知不会丢失
+            self._wakeup.clear()
+            try:
+                dispatched = await self._fill_window()
+            except Exception as e:
+                self.logger.error(f"获取待处理图片失败: {str(e)}")
+                dispatched = 0
+
+            if dispatched:
+                continue
+            # 窗口已满或没有待处理图片，等待新上传、在途完成或兜底轮询
+            # 已订阅通知时只需低频轮询，用于处理失败图片的重试
+            timeout = settings.OCR_IDLE_POLL_INTERVAL if self._listening else self._idle_interval
+            now = time.monotonic()
+            for image_id in [i for i, at in self._retry_at.items() if at <= now]:
+                del self._retry_at[image_id]
+            if self._retry_at:
+                timeout = min(timeout, min(self._retry_at.values()) - now + 1)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            # 上传突发时每张图片都会唤醒一次，稍等片刻再认领，把一批图片合并到一次查询中
+            await asyncio.sleep(settings.OCR_CLAIM_DELAY)
+
+    async def start(self):
         """启动处理服务"""
         if self._running:
             return
             
         self._running = True
-        asyncio.create_task(self._run_loop())
+        tokenizer.start()
+        if settings.EMBEDDING_ENABLED:
+            embedding_processor.start()
+        await self.ocr_client.start()
+        self._task = asyncio.create_task(self._run_loop())
 
-    def stop(self):
+    async def stop(self):
         """停止处理服务"""
-        self._running = False 
\ No newline at end of file
+        self._running = False
+        tasks = [task for task in [self._task, *self._workers] if task]
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+        self._task = None
+        self._in_flight.clear()
+        self._embedding.clear()
+        try:
+            await self._release_leases()
+        except Exception as e:
+            self.logger.error(f"释放租约失败: {str(e)}")
+        await self.ocr_client.close()
+        tokenizer.shutdown()
+        embedding_processor.shutdown()
+
+# 全局调度器实例，上传接口通过它唤醒调度
+ocr_scheduler = OCRScheduler()
@@ -0,0 +1,49 @@
+"""
+按需生成缩略图：搜索结果列表只需要小图，不必下载原图。
+缩略图按固定尺寸（THUMBNAIL_SIZES）生成并缓存在 THUMBNAIL_DIR，
+原图被保留策略重新编码后（修改时间变化）自动重新生成
+"""
+import os
+import threading
+from PIL import Image as PILImage
+from app.core.config import settings
+
+def thumbnail_path(relative_path: str, size: str) -> str:
+    stem, _ = os.path.splitext(relative_path)
+    return os.path.join(settings.THUMBNAIL_DIR, size, f"{stem}.webp")
+
+def etag(path: str, size: str | None = None) -> str:
+    """由原图的修改时间和大小生成 ETag，不同尺寸的缩略图使用不同的 ETag"""
+    stat = os.stat(path)
+    return f'"{size or "original"}-{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+def get_thumbnail(relative_path: str, size: str) -> str:
+    """返回缩略图路径，缓存不存在或早于原图时重新生成"""
+    source = os.path.join(settings.UPLOAD_DIR, relative_path)
+    target = thumbnail_path(relative_path, size)
+    try:
+        if os.path.getmtime(target) >= os.path.getmtime(source):
+            return target
+    except FileNotFoundError:
+        pass
+
+    width = settings.THUMBNAIL_SIZES[size]
+    with PILImage.open(source) as image:
+        image.load()
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), PILImage.LANCZOS)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # 同一张缩略图可能被并发请求同时生成，各自写临时文件后替换
+        temp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        image.save(temp_path, format="WEBP", quality=settings.THUMBNAIL_QUALITY)
+    os.replace(temp_path, target)
+    return target
+
+def remove_thumbnails(relative_path: str):
+    """删除图片的所有缓存缩略图"""
+    for size in settings.THUMBNAIL_SIZES:
+        try:
+            os.remove(thumbnail_path(relative_path, size))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,176 @@
+"""
+分词模块：索引（OCR文本）和查询解析共用同一个分词器，保证两边切分一致。
+
+- 通过 TOKENIZER 配置选择分词器实现，新增实现只需注册到 TOKENIZERS
+- 支持 TOKENIZER_USER_DICT 自定义词典
+- 按行缓存分词结果，应用名、窗口标题和界面文字大量重复时可直接命中
+- 词典前缀缓存保存在 TOKENIZER_CACHE_DIR，可在构建镜像时预先生成:
+    python -m app.services.tokenizer
+"""
+import asyncio
+import logging
+import math
+import multiprocessing as mp
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import Dict, List, Optional, Type
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class BaseTokenizer:
+    """分词器接口"""
+
+    def initialize(self):
+        """加载词典等资源"""
+
+    def cut_for_search(self, text: str) -> List[str]:
+        """索引分词，尽量切出所有可能的词以提高召回"""
+        raise NotImplementedError
+
+    def cut(self, text: str) -> List[str]:
+        """查询分词"""
+        raise NotImplementedError
+
+class SimpleTokenizer(BaseTokenizer):
+    """按空白切分，不依赖词典"""
+
+    def cut_for_search(self, text: str) -> List[str]:
+        return text.split()
+
+    def cut(self, text: str) -> List[str]:
+        return text.split()
+
+class JiebaTokenizer(BaseTokenizer):
+    """jieba 分词，使用独立实例以便配置词典缓存目录和自定义词典"""
+
+    def __init__(self):
+        import jieba
+        jieba.setLogLevel(logging.WARNING)
+        self._tokenizer = jieba.Tokenizer()
+        if settings.TOKENIZER_CACHE_DIR:
+            os.makedirs(settings.TOKENIZER_CACHE_DIR, exist_ok=True)
+            self._tokenizer.tmp_dir = settings.TOKENIZER_CACHE_DIR
+        self._initialized = False
+
+    def initialize(self):
+        if self._initialized:
+            return
+        self._tokenizer.initialize()
+        if settings.TOKENIZER_USER_DICT:
+            self._tokenizer.load_userdict(settings.TOKENIZER_USER_DICT)
+            logger.info(f"已加载自定义词典: {settings.TOKENIZER_USER_DICT}")
+        self._initialized = True
+
+    def cut_for_search(self, text: str) -> List[str]:
+        self.initialize()
+        return list(self._tokenizer.cut_for_search(text))
+
+    def cut(self, text: str) -> List[str]:
+        self.initialize()
+        return list(self._tokenizer.cut(text))
+
+TOKENIZERS: Dict[str, Type[BaseTokenizer]] = {
+    "jieba": JiebaTokenizer,
+    "simple": SimpleTokenizer,
+}
+
+@lru_cache()
+def get_tokenizer() -> BaseTokenizer:
+    if settings.TOKENIZER not in TOKENIZERS:
+        raise ValueError(f"不支持的分词器: {settings.TOKENIZER}")
+    return TOKENIZERS[settings.TOKENIZER]()
+
+@lru_cache(maxsize=settings.TOKENIZER_CACHE_SIZE)
+def _segment_line(line: str) -> str:
+    return " ".join(token for token in get_tokenizer().cut_for_search(line) if token.strip())
+
+def segment_texts(texts: List[str]) -> List[str]:
+    """在当前进程中分词，按行缓存，返回以空格分隔的分词结果"""
+    return [" ".join(_segment_line(line) for line in text.splitlines()) for text in texts]
+
+# tsquery 中有特殊含义的字符
+_TSQUERY_SPECIAL = re.compile(r"[&|!():*<>'\\\s]+")
+
+def parse_query(query: str) -> Optional[str]:
+    """
+    把用户输入解析为 to_tsquery 表达式：
+    先按空白拆分关键词，每个关键词再用同一个分词器切分，所有词之间为 AND 关系。
+    词用单引号包裹，避免特殊字符导致 to_tsquery 报错。没有有效词时返回 None
+    """
+    tokenizer = get_tokenizer()
+    lexemes = []
+    for keyword in query.split():
+        for token in tokenizer.cut(keyword):
+            token = _TSQUERY_SPECIAL.sub("", token)
+            if token and token not in lexemes:
+                lexemes.append(token)
+    if not lexemes:
+        return None
+    return " & ".join(f"'{lexeme}'" for lexeme in lexemes)
+
+# 分词进程池，jieba 是纯 Python 的 CPU 密集操作，放在独立进程中执行
+_executor: Optional[ProcessPoolExecutor] = None
+
+def _initialize_worker():
+    """每个分词进程启动时加载一次词典"""
+    get_tokenizer().initialize()
+
+def _warm_up() -> bool:
+    return True
+
+def start():
+    """启动分词进程池，并让每个进程预先加载词典"""
+    global _executor
+    if _executor is not None or settings.TOKENIZER_WORKERS <= 0:
+        return
+    # 使用 spawn 避免 fork 带有事件循环和线程的主进程
+    _executor = ProcessPoolExecutor(
+        max_workers=settings.TOKENIZER_WORKERS,
+        mp_context=mp.get_context("spawn"),
+        initializer=_initialize_worker,
+    )
+    for _ in range(settings.TOKENIZER_WORKERS):
+        _executor.submit(_warm_up)
+    logger.info(f"分词进程池启动, 进程数: {settings.TOKENIZER_WORKERS}")
+
+def shutdown():
+    """关闭分词进程池"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def segment(texts: List[str]) -> List[str]:
+    """
+    批量分词：按进程数切分后并行处理，不占用事件循环。
+    未启用进程池时在默认线程池中执行
+    """
+    if not texts:
+        return []
+    loop = asyncio.get_running_loop()
+    if _executor is None:
+        return await loop.run_in_executor(None, segment_texts, texts)
+
+    chunk_size = max(1, math.ceil(len(texts) / settings.TOKENIZER_WORKERS))
+    try:
+        chunks = await asyncio.gather(*(
+            loop.run_in_executor(_executor, segment_texts, texts[i:i + chunk_size])
+            for i in range(0, len(texts), chunk_size)
+        ))
+    except BrokenProcessPool:
+        # 分词进程异常退出，重建进程池，本次在线程池中完成
+        logger.error("分词进程池异常, 正在重建")
+        shutdown()
+        start()
+        return await loop.run_in_executor(None, segment_texts, texts)
+    return [text for chunk in chunks for text in chunk]
+
+if __name__ == "__main__":
+    # 预先生成词典缓存，缩短服务启动时间
+    logging.basicConfig(level=logging.INFO)
+    get_tokenizer().initialize()
+    logger.info(f"词典缓存已生成: {settings.TOKENIZER_CACHE_DIR}")
@@ -0,0 +1,145 @@
+"""
+OCR结果写入吞吐量压测
+
+对比逐行写入（每张图片一次 SELECT + INSERT/UPDATE）与批量 upsert
+（一条 INSERT ... ON CONFLICT DO UPDATE + 一条 UPDATE）的每秒写入行数。
+会在配置的数据库中插入 file_path 以 benchmark/ 开头的临时图片记录，结束后删除。
+
+用法（在 core-service 目录下，使用测试数据库）:
+    python -m benchmarks.ocr_write_throughput --images 2000 --batch-size 50
+"""
+import argparse
+import asyncio
+import random
+import string
+import time
+from datetime import datetime
+
+from sqlalchemy import delete, func, insert, select
+
+from app.db import partitions
+from app.db.database import SessionLocal, init_db
+from app.models.image import Image
+from app.models.image_ocr import ImageOCR
+from app.services.scheduler import OCRScheduler, build_ocr_summary
+from app.services.tokenizer import segment_texts
+
+
+def fake_ocr_result(lines: int) -> list[dict]:
+    return [
+        {
+            "text": "".join(random.choices(string.ascii_letters + " ", k=40)),
+            "confidence": random.random(),
+            "position": [[0.0, i * 20.0], [400.0, i * 20.0], [400.0, i * 20.0 + 18], [0.0, i * 20.0 + 18]],
+        }
+        for i in range(lines)
+    ]
+
+
+async def create_images(count: int) -> list[int]:
+    rows = [
+        {
+            "file_path": f"benchmark/{i}.webp",
+            "file_extension": "webp",
+            "captured_at": datetime.now(),
+            "ocr_completed": False,
+            "embedding_completed": False,
+        }
+        for i in range(count)
+    ]
+    await partitions.ensure_partitions(row["captured_at"] for row in rows)
+    async with SessionLocal() as db:
+        ids = (await db.scalars(insert(Image).returning(Image.id, sort_by_parameter_order=True), rows)).all()
+        await db.commit()
+    return list(ids)
+
+
+async def reset(ids: list[int]):
+    async with SessionLocal() as db:
+        await db.execute(delete(ImageOCR).where(ImageOCR.id.in_(ids)))
+        await db.execute(
+            Image.__table__.update().where(Image.id.in_(ids)).values(ocr_completed=False, embedding_completed=False)
+        )
+        await db.commit()
+
+
+async def cleanup(ids: list[int]):
+    async with SessionLocal() as db:
+        await db.execute(delete(ImageOCR).where(ImageOCR.id.in_(ids)))
+        await db.execute(delete(Image).where(Image.id.in_(ids)))
+        await db.commit()
+
+
+async def save_row_by_row(scheduler: OCRScheduler, batch: list[int], results: dict[int, list[dict]]):
+    """改造前的写法：每张图片先查询再新增或修改"""
+    async with SessionLocal() as db:
+        images = (await db.scalars(select(Image).where(Image.id.in_(batch)))).all()
+        for image in images:
+            ocr_metadata, search_text = scheduler._build_ocr_record(image, results[image.id])
+            search_text_seg = (await scheduler._segment([search_text]))[0]
+            image_ocr = await db.get(ImageOCR, (image.id, image.captured_at))
+            if not image_ocr:
+                image_ocr = ImageOCR(id=image.id, captured_at=image.captured_at, ocr_metadata=ocr_metadata)
+                db.add(image_ocr)
+            else:
+                image_ocr.ocr_metadata = ocr_metadata
+            image_ocr.ocr_summary = build_ocr_summary(ocr_metadata)
+            image_ocr.search_vector = func.to_tsvector('simple', search_text_seg)
+            image.ocr_completed = True
+            image.embedding_completed = True
+        await db.commit()
+
+
+async def save_bulk(scheduler: OCRScheduler, batch: list[int], results: dict[int, list[dict]]):
+    async with SessionLocal() as db:
+        images = (await db.scalars(select(Image).where(Image.id.in_(batch)))).all()
+    await scheduler._save_ocr_results([(image, results[image.id]) for image in images])
+
+
+async def run(name: str, save, scheduler, ids, results, batch_size: int) -> float:
+    start = time.perf_counter()
+    for i in range(0, len(ids), batch_size):
+        await save(scheduler, ids[i:i + batch_size], results)
+    elapsed = time.perf_counter() - start
+    rate = len(ids) / elapsed
+    print(f"{name}: {len(ids)} 行, 耗时 {elapsed:.2f}秒, {rate:.0f} 行/秒")
+    return rate
+
+
+async def main(args):
+    await init_db()
+    scheduler = OCRScheduler()
+    ids = await create_images(args.images)
+    results = {image_id: fake_ocr_result(args.lines) for image_id in ids}
+    try:
+        # 分词在两种写法中相同，预先计算后单独统计，只比较数据库写入
+        async with SessionLocal() as db:
+            images = (await db.scalars(select(Image).where(Image.id.in_(ids)))).all()
+        search_texts = [scheduler._build_ocr_record(image, results[image.id])[1] for image in images]
+        start = time.perf_counter()
+        segmented = dict(zip(search_texts, segment_texts(search_texts)))
+        print(f"分词: {len(ids)} 行, 耗时 {time.perf_counter() - start:.2f}秒")
+
+        async def cached_segment(texts):
+            return [segmented[text] for text in texts]
+        scheduler._segment = cached_segment
+
+        # 新增：t_image_ocr 中没有记录；更新：记录已存在，走冲突更新
+        for phase in ("新增", "更新"):
+            if phase == "新增":
+                await reset(ids)
+            before = await run(f"逐行写入({phase})", save_row_by_row, scheduler, ids, results, args.batch_size)
+            if phase == "新增":
+                await reset(ids)
+            after = await run(f"批量upsert({phase})", save_bulk, scheduler, ids, results, args.batch_size)
+            print(f"{phase}提升: {after / before:.1f}x")
+    finally:
+        await cleanup(ids)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OCR结果写入吞吐量压测")
+    parser.add_argument("--images", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--lines", type=int, default=30, help="每张图片的OCR文本行数")
+    asyncio.run(main(parser.parse_args()))
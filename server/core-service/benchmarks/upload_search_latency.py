@@ -0,0 +1,146 @@
+"""
+上传突发期间的搜索延迟压测
+
+在后台持续并发上传截图的同时循环调用搜索接口，分别统计空闲阶段和上传阶段的
+搜索延迟 p50/p99，用于确认上传流程不会阻塞事件循环。
+
+用法:
+    python benchmarks/upload_search_latency.py --server http://localhost:8000 \
+        --username admin --password admin --uploads 500 --concurrency 16 [--rate 10]
+
+不限速时上传会占满 CPU，上传越快搜索越慢，不同版本之间不好比较；
+--rate 按固定速率上传，在相同上传负载下对比搜索延迟。
+
+参考结果：上传中的搜索 p99（ms），每组 3 次取中位数，空闲时 p99 为 11-17ms。
+单核 CPU，服务、PostgreSQL 和压测脚本共用这一个核，OCR 服务未启动；
+2560x1440 WebP 约 1.8MB，并发 4，搜索类型 1。没有多核环境，未在多核机器上复测。
+
+                                  --rate 10   --rate 20            不限速
+    上传改为线程池 + asyncpg 之前     22.7        35.4                 63.0（29 张/秒）
+    上传改为线程池 + asyncpg 之后    119.3       173.1（只能到 16 张/秒） 164.6（16 张/秒）
+    去掉 WebP 解码等阻塞之后          27.5        52.7                109.8（37 张/秒）
+
+线程池 + asyncpg 之后的版本中，每次上传用 Pillow 打开 WebP 读取 EXIF 时都会创建解码器并分配
+整幅画布（约 20ms CPU），加上每张图片单独认领/释放的调度器查询和完整 GC 的停顿，
+单核上与事件循环争抢 CPU，上传期间的搜索 p99 反而比改动之前更高。
+并发 16 时改动之前的同步连接池耗尽（QueuePool 超时），上传和搜索都会失败
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+from datetime import datetime, timedelta
+from io import BytesIO
+
+import aiohttp
+from PIL import Image
+
+
+def make_screenshot(width: int, height: int) -> bytes:
+    """
+    生成一张随机内容的 WebP 图片，和客户端一样在 EXIF ImageDescription 中写入窗口信息。
+    噪声强度固定，多次运行的图片大小基本一致，结果才能互相比较
+    """
+    image = Image.effect_noise((width, height), 50).convert("RGB")
+    metadata = {"appName": "benchmark", "windowTitle": "upload_search_latency"}
+    exif = Image.Exif()
+    exif[0x010e] = base64.b64encode(json.dumps(metadata).encode()).decode()
+    buffer = BytesIO()
+    image.save(buffer, format="WEBP", quality=80, exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+def make_filename() -> str:
+    """按客户端格式生成文件名: 0-YYMMDD-HHMMSS.webp"""
+    captured_at = datetime.now() - timedelta(seconds=random.randint(0, 365 * 24 * 3600))
+    return f"0-{captured_at.strftime('%y%m%d-%H%M%S')}.webp"
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def login(session: aiohttp.ClientSession, api: str, username: str, password: str):
+    async with session.post(f"{api}/auth/login", json={"username": username, "password": password}) as response:
+        data = await response.json()
+        if data.get("status") != 200:
+            raise RuntimeError(f"登录失败: {data}")
+
+
+async def search_loop(session: aiohttp.ClientSession, api: str, query: str, stop: asyncio.Event, samples: list[float]):
+    while not stop.is_set():
+        start = time.perf_counter()
+        async with session.post(f"{api}/image/search", json={"query": query, "type": 1}) as response:
+            await response.read()
+        samples.append((time.perf_counter() - start) * 1000)
+
+
+async def upload_worker(session: aiohttp.ClientSession, api: str, queue: asyncio.Queue, image: bytes):
+    while await queue.get() is not None:
+        data = aiohttp.FormData()
+        data.add_field("file", image, filename=make_filename(), content_type="image/webp")
+        async with session.post(f"{api}/image/upload", data=data) as response:
+            await response.read()
+
+
+async def measure(session, api: str, query: str, seconds: float) -> list[float]:
+    samples: list[float] = []
+    stop = asyncio.Event()
+    task = asyncio.create_task(search_loop(session, api, query, stop, samples))
+    await asyncio.sleep(seconds)
+    stop.set()
+    await task
+    return samples
+
+
+async def main(args):
+    api = f"{args.server.rstrip('/')}/timebox/api"
+    image = make_screenshot(args.width, args.height)
+    async with aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
+        await login(session, api, args.username, args.password)
+
+        idle = await measure(session, api, args.query, args.idle_seconds)
+
+        queue: asyncio.Queue = asyncio.Queue()
+        samples: list[float] = []
+        stop = asyncio.Event()
+        search_task = asyncio.create_task(search_loop(session, api, args.query, stop, samples))
+        upload_start = time.perf_counter()
+        workers = [asyncio.create_task(upload_worker(session, api, queue, image)) for _ in range(args.concurrency)]
+        # 不限速时尽快上传；限速时按固定速率投放，便于在相同上传负载下对比
+        for index in range(args.uploads):
+            if args.rate:
+                await asyncio.sleep(max(0.0, upload_start + index / args.rate - time.perf_counter()))
+            queue.put_nowait(index)
+        for _ in workers:
+            queue.put_nowait(None)
+        await asyncio.gather(*workers)
+        upload_elapsed = time.perf_counter() - upload_start
+        stop.set()
+        await search_task
+
+    print(f"上传 {args.uploads} 张图片 ({len(image) / 1024:.0f}KB/张), 耗时 {upload_elapsed:.2f}秒, "
+          f"{args.uploads / upload_elapsed:.1f} 张/秒")
+    for name, values in (("空闲", idle), ("上传中", samples)):
+        print(f"{name}: 搜索 {len(values)} 次, p50={percentile(values, 50):.1f}ms, p99={percentile(values, 99):.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="上传突发期间的搜索延迟压测")
+    parser.add_argument("--server", default="http://localhost:8000")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="defaultpassword")
+    parser.add_argument("--query", default="")
+    parser.add_argument("--uploads", type=int, default=300)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rate", type=float, default=0, help="每秒上传张数，0 表示不限速")
+    parser.add_argument("--idle-seconds", type=float, default=5)
+    parser.add_argument("--width", type=int, default=2560)
+    parser.add_argument("--height", type=int, default=1440)
+    asyncio.run(main(parser.parse_args()))
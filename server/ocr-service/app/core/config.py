@@ -1,4 +1,5 @@
 from functools import lru_cache
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -15,6 +16,22 @@ class Settings(BaseSettings):
     OCR_SERVER_HOST: str = "0.0.0.0"  # 默认监听所有接口
     OCR_SERVER_PORT: int = 8001      # 默认端口
     OCR_NUM_WORKERS: int = 1  # 默认worker数量
+    OCR_MAX_BATCH_SIZE: int = 64  # 批量接口单次最多处理的图片数
+    OCR_SHM_SLOT_SIZE: int = 8 * 1024 * 1024  # 每个共享内存槽位的初始大小，更大的图片会自动扩容
+    OCR_MAX_QUEUE_SIZE: int = 128  # 等待分配工作进程的最大图片数，超过时返回 503
+    OCR_TASK_TIMEOUT: float = 60  # 单张图片的最长处理时间（秒），超时终止并替换工作进程
+    OCR_WORKER_MAX_TASKS: int = 1000  # 工作进程处理该数量的图片后替换，0 表示不限制
+    OCR_WORKER_MAX_RSS_MB: int = 2048  # 工作进程常驻内存超过该值（MB）后替换，0 表示不限制，仅 Linux 有效
+    OCR_WORKER_RESTART_DELAY: float = 5  # 工作进程初始化失败后重启的等待时间（秒）
+
+    # 识别前预处理
+    OCR_MAX_SIDE: int = 0  # 图片最长边超过该值时先缩小，0 表示不缩小
+    OCR_GRAYSCALE: bool = False  # 是否转为灰度后识别
+
+    # 识别结果缓存（按图片内容哈希）
+    OCR_CACHE_MAX_ENTRIES: int = 1024  # 内存中缓存的结果数，0 表示不使用内存缓存
+    OCR_CACHE_DIR: Optional[str] = None  # 磁盘缓存目录，为空时只使用内存缓存
+    OCR_CACHE_DISK_MAX_MB: int = 256  # 磁盘缓存的最大大小（MB），超过时删除最久未使用的结果
 
     class Config:
         case_sensitive = True
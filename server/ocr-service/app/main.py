@@ -1,8 +1,15 @@
 import logging
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Header
+from fastapi import FastAPI, APIRouter, UploadFile, File, Form, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
-from app.services.ocr_processor import OCRProcessor
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from pydantic import BaseModel
+from app.services.ocr_processor import OCRProcessor, OCRBusyError
+from app.services.result_cache import ResultCache, content_hash
 import os
+import re
+import json
+import asyncio
 import tempfile
 from app.core.config import settings
 
@@ -15,6 +22,7 @@ logging.basicConfig(
 
 # 创建OCR处理器实例
 ocr_processor = OCRProcessor()
+result_cache = ResultCache()
 
 # 创建主路由器
 root_router = APIRouter()
@@ -29,33 +37,175 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def validate_regions(regions) -> Optional[List[List[int]]]:
+    """校验识别区域 [[x1, y1, x2, y2], ...]，None 表示识别整张图片"""
+    if regions is None:
+        return None
+    try:
+        parsed = [[int(value) for value in region] for region in regions]
+    except (ValueError, TypeError):
+        parsed = None
+    if not parsed or any(len(region) != 4 or region[0] >= region[2] or region[1] >= region[3] for region in parsed):
+        raise HTTPException(status_code=400, detail="Invalid regions")
+    return parsed
+
+def parse_regions(regions: Optional[str]) -> Optional[List[List[int]]]:
+    """解析 JSON 格式的识别区域"""
+    if not regions:
+        return None
+    try:
+        return validate_regions(json.loads(regions))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid regions")
+
+async def recognize(content: bytes, regions: Optional[List[List[int]]]) -> list:
+    """识别图片，相同内容和区域的图片直接返回缓存的结果"""
+    digest = await asyncio.to_thread(content_hash, content)
+    result = await result_cache.get(digest, regions)
+    if result is None:
+        result = await ocr_processor.process_image_async(content, regions)
+        await result_cache.put(digest, regions, result)
+    return result
+
+def verify_token(authorization: str):
+    """验证token"""
+    if not authorization or authorization != f"Bearer {settings.OCR_API_TOKEN}":
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid or missing token"
+        )
+
 @root_router.post("/ocr")
 async def process_image(
     file: UploadFile = File(...),
+    regions: Optional[str] = Form(None),
     authorization: str = Header(None)
 ):
     """
-    处理上传的图片文件并返回OCR结果
+    处理上传的图片文件并返回OCR结果。
+    regions 为可选的 JSON 区域列表 [[x1, y1, x2, y2], ...]，传入时只识别这些区域
     """
-    # 验证token
-    if not authorization or authorization != f"Bearer {settings.OCR_API_TOKEN}":
-        raise HTTPException(
-            status_code=401,
-            detail="Invalid or missing token"
-        )
+    verify_token(authorization)
+    parsed_regions = parse_regions(regions)
         
     try:
         # 直接读取上传文件的内容
         content = await file.read()
         
         # 调用OCR处理,传入图片二进制数据
-        result = await ocr_processor.process_image_async(content)
+        result = await recognize(content, parsed_regions)
         return result
 
+    except OCRBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
         logging.error(f"OCR处理错误: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@root_router.post("/ocr/batch")
+async def process_images(
+    files: List[UploadFile] = File(...),
+    regions: Optional[str] = Form(None),
+    authorization: str = Header(None)
+):
+    """
+    批量处理图片，所有图片交给进程池并行处理，每完成一张就以 NDJSON 返回一行:
+    {"index": 序号, "filename": 文件名, "status": 200, "result": [...]}
+    处理失败时 status 为 500，并带有 detail 字段。
+    regions 为可选的 JSON 列表，与 files 一一对应，每项为该图片的识别区域或 null（整张识别）
+    """
+    verify_token(authorization)
+    if len(files) > settings.OCR_MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many files, at most {settings.OCR_MAX_BATCH_SIZE} per request"
+        )
+    # 队列放不下整批时立即拒绝，由调用方换一个服务或稍后重试
+    if not ocr_processor.has_capacity(len(files)):
+        raise HTTPException(status_code=503, detail="OCR服务繁忙", headers={"Retry-After": "1"})
+
+    batch_regions: List[Optional[List[List[int]]]] = [None] * len(files)
+    if regions:
+        try:
+            items = json.loads(regions)
+        except ValueError:
+            items = None
+        if not isinstance(items, list) or len(items) != len(files):
+            raise HTTPException(status_code=400, detail="Invalid regions")
+        batch_regions = [validate_regions(item) for item in items]
+
+    contents = [(file.filename, await file.read()) for file in files]
+
+    async def run(index: int, filename: str, content: bytes) -> dict:
+        try:
+            result = await recognize(content, batch_regions[index])
+            return {"index": index, "filename": filename, "status": 200, "result": result}
+        except OCRBusyError as e:
+            return {"index": index, "filename": filename, "status": 503, "detail": str(e)}
+        except Exception as e:
+            logging.error(f"OCR处理错误 {filename}: {str(e)}")
+            return {"index": index, "filename": filename, "status": 500, "detail": str(e)}
+
+    async def stream():
+        tasks = [
+            asyncio.create_task(run(index, filename, content))
+            for index, (filename, content) in enumerate(contents)
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task, ensure_ascii=False) + "\n"
+        finally:
+            # 客户端断开时取消尚未开始的任务
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+_HASH_PATTERN = re.compile(r"[0-9a-fA-F]{64}")
+
+class LookupItem(BaseModel):
+    hash: str  # 图片内容的 SHA-256
+    regions: Optional[List[List[int]]] = None
+
+class LookupRequest(BaseModel):
+    items: List[LookupItem]
+
+@root_router.post("/ocr/lookup")
+async def lookup(request: LookupRequest, authorization: str = Header(None)):
+    """
+    按图片内容的 SHA-256 查询结果缓存，客户端先查询，只上传未命中的图片。
+    返回 {"results": [...]}，与 items 一一对应，未命中为 null
+    """
+    verify_token(authorization)
+    if len(request.items) > settings.OCR_MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Too many items, at most {settings.OCR_MAX_BATCH_SIZE} per request"
+        )
+    if any(not _HASH_PATTERN.fullmatch(item.hash) for item in request.items):
+        raise HTTPException(status_code=400, detail="Invalid hash")
+    return {
+        "results": [
+            await result_cache.get(item.hash, validate_regions(item.regions))
+            for item in request.items
+        ]
+    }
+
+@root_router.get("/status")
+async def status(authorization: str = Header(None)):
+    """工作进程、等待队列和结果缓存状态"""
+    verify_token(authorization)
+    return {**ocr_processor.stats(), "cache": result_cache.stats()}
+
+@app.on_event("startup")
+async def startup_event():
+    ocr_processor.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 等待进程池退出并释放共享内存
+    await ocr_processor.cleanup()
+
 @root_router.get("/")
 async def read_root():
     return {"message": "Welcome to OCR Service"}
@@ -1,10 +1,14 @@
 import platform
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple, Optional
+from collections import deque
 import multiprocessing as mp
-from multiprocessing.pool import Pool
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
 import asyncio
 import logging
-from functools import partial
+import os
+import signal
+import threading
 from PIL import Image
 import numpy as np
 import io
@@ -31,6 +35,8 @@ class OCRWorker:
         self.logger = setup_logger(f"{__name__}.worker")
         self.ocr = None
         self.is_mac = platform.system() == "Darwin"
+        # 已映射的共享内存槽位，槽位扩容后按新名称重新映射
+        self._shm: Optional[SharedMemory] = None
         self._initialize()
         
     def _initialize(self):
@@ -51,37 +57,93 @@ class OCRWorker:
                 self.logger.error(f"OCR初始化失败: {e}")
                 raise
 
-    def process_image(self, image_bytes: bytes) -> List[Dict[str, Any]]:
-        """处理单张图片"""
+    def _attach(self, name: str) -> SharedMemory:
+        if self._shm is None or self._shm.name != name:
+            if self._shm is not None:
+                self._shm.close()
+            self._shm = SharedMemory(name=name)
+        return self._shm
+
+    def process_shared(self, name: str, size: int, regions: Optional[List[List[int]]] = None) -> Tuple[List[Dict[str, Any]], float]:
+        """
+        从共享内存槽位读取图片并处理，返回识别结果和处理耗时（秒），
+        主进程用往返耗时减去处理耗时得到进程间通信的开销
+        """
+        start_time = time.perf_counter()
+        shm = self._attach(name)
+        # 解码需要完整的文件内容，这里的一次内存拷贝不经过管道和序列化
+        image_bytes = bytes(shm.buf[:size])
+        result = self.process_image(image_bytes, regions)
+        return result, time.perf_counter() - start_time
+
+    @staticmethod
+    def _preprocess(image: Image.Image) -> Tuple[Image.Image, float]:
+        """
+        识别前的预处理：缩小到最长边不超过 OCR_MAX_SIDE，可选转为灰度。
+        返回处理后的图片和缩放比例，识别结果的坐标按比例还原
+        """
+        scale = 1.0
+        max_side = settings.OCR_MAX_SIDE
+        if max_side and max(image.size) > max_side:
+            scale = max_side / max(image.size)
+            size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            # 先用整数倍缩小快速降采样，再用 LANCZOS 保留文字边缘
+            image = image.resize(size, Image.LANCZOS, reducing_gap=2.0)
+        if settings.OCR_GRAYSCALE:
+            image = image.convert("L")
+        elif image.mode != "RGB":
+            image = image.convert("RGB")
+        return image, scale
+
+    @staticmethod
+    def _map_position(position, scale: float, offset: Tuple[int, int]):
+        """把预处理后图片中的坐标还原为原图坐标，支持点列表和 [x1, y1, x2, y2]"""
+        if scale == 1.0 and offset == (0, 0):
+            return position
+        if position and isinstance(position[0], (list, tuple)):
+            return [[x / scale + offset[0], y / scale + offset[1]] for x, y in position]
+        return [value / scale + offset[index % 2] for index, value in enumerate(position)]
+
+    def _recognize(self, image: Image.Image) -> List[Tuple[str, float, Any]]:
+        """识别一张预处理后的图片，返回 (文字, 置信度, 坐标)"""
+        if self.is_mac:
+            from ocrmac import ocrmac
+            result = ocrmac.OCR(image, language_preference=['zh-Hans']).recognize(px=True)
+            return [(text, confidence, position) for text, confidence, position in result or []]
+        array = np.asarray(image)
+        if array.ndim == 3:
+            # RapidOCR 的 ndarray 输入按 BGR 处理
+            array = np.ascontiguousarray(array[:, :, ::-1])
+        result, _ = self.ocr(array)
+        return [(text, float(confidence), position) for position, text, confidence in result or []]
+
+    def process_image(self, image_bytes: bytes, regions: Optional[List[List[int]]] = None) -> List[Dict[str, Any]]:
+        """
+        处理单张图片。传入 regions（原图坐标 [x1, y1, x2, y2] 列表）时只识别这些区域，
+        坐标仍相对于原图
+        """
         start_time = time.time()
         
         try:
-            if self.is_mac:
-                # Mac系统下仍需要PIL Image
-                from ocrmac import ocrmac
-                image = Image.open(io.BytesIO(image_bytes))
-                self.logger.info(f"开始处理图片, 尺寸: {image.size}")
-                result = ocrmac.OCR(image, language_preference=['zh-Hans']).recognize(px=True)
-            else:
-                # 非Mac系统直接使用bytes
-                self.logger.info("开始处理图片")
-                result, _ = self.ocr(image_bytes)
-                
-            if not result:
-                return []
-                
+            image = Image.open(io.BytesIO(image_bytes))
+            image.load()
+            self.logger.info(f"开始处理图片, 尺寸: {image.size}")
+            crops = [(image, (0, 0))]
+            if regions:
+                crops = [
+                    (image.crop(tuple(region)), (region[0], region[1]))
+                    for region in regions
+                ]
+
             processed_results = []
-            for item in result:
-                if self.is_mac:
-                    text, confidence, position = item
-                else:
-                    position, text, confidence = item
-                    
-                processed_results.append({
-                    'text': text,
-                    'confidence': float(confidence) if not self.is_mac else confidence,
-                    'position': position
-                })
+            for crop, offset in crops:
+                crop, scale = self._preprocess(crop)
+                for text, confidence, position in self._recognize(crop):
+                    processed_results.append({
+                        'text': text,
+                        'confidence': confidence,
+                        'position': self._map_position(position, scale, offset)
+                    })
             
             process_time = time.time() - start_time
             self.logger.info(f"图片处理完成, 耗时: {process_time:.2f}秒")
@@ -93,56 +155,312 @@ class OCRWorker:
             self.logger.error(f"图片处理错误: {e}, 耗时: {process_time:.2f}秒")
             raise
 
+def _current_rss() -> int:
+    """当前进程的常驻内存（字节），只在 Linux 上可用，其他平台返回 0"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+def _worker_main(conn: Connection):
+    """
+    工作进程主循环：初始化OCR引擎后发送 ready，之后逐个处理 (共享内存名称, 图片大小, 识别区域)，
+    收到 None 或主进程断开时退出
+    """
+    # Ctrl+C 由主进程处理，工作进程由主进程负责停止
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker = OCRWorker()
+    conn.send(("ready", None))
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        try:
+            result, process_time = worker.process_shared(*task)
+            conn.send(("done", (result, process_time, _current_rss())))
+        except Exception as e:
+            conn.send(("error", str(e)))
+
+class OCRBusyError(Exception):
+    """等待队列已满"""
+
+class _Worker:
+    """主进程中对一个工作进程的管理：进程、通信管道、共享内存槽位和当前任务"""
+    def __init__(self, index: int, process, conn: Connection, shm: SharedMemory):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.shm = shm
+        self.ready = False
+        self.retiring = False  # 已通知退出，不再分配任务
+        self.tasks_done = 0
+        self.job: Optional["_Job"] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.released = False
+
+    def release(self):
+        """关闭管道并删除共享内存，可重复调用"""
+        if self.released:
+            return
+        self.released = True
+        if self.timer is not None:
+            self.timer.cancel()
+        self.conn.close()
+        self.shm.close()
+        self.shm.unlink()
+
+class _Job:
+    def __init__(self, image_bytes: bytes, regions: Optional[List[List[int]]], future: asyncio.Future):
+        self.image_bytes = image_bytes
+        self.regions = regions
+        self.future = future
+        self.start_time = time.perf_counter()
+
 class OCRProcessor:
-    """OCR处理器"""
+    """
+    OCR处理器，自行管理工作进程：
+
+    - 图片通过每个工作进程独占的共享内存槽位传递，管道中只传递槽位名称和大小
+    - 每个工作进程有一个读取线程接收结果，通过 call_soon_threadsafe 交给事件循环
+    - 单张超过 OCR_TASK_TIMEOUT 秒时终止该进程；进程异常退出时当前任务失败并自动补充新进程
+    - 处理 OCR_WORKER_MAX_TASKS 张或常驻内存超过 OCR_WORKER_MAX_RSS_MB 后平滑替换进程
+    - 等待分配的任务超过 OCR_MAX_QUEUE_SIZE 时立即抛出 OCRBusyError，由接口返回 503
+    """
     def __init__(self):
         self.logger = setup_logger(f"{__name__}.processor")
-        self._pool = None
-        self._semaphore = None
-        self._initialize()
-        
-    @staticmethod
-    def _initialize_worker():
-        """为每个进程初始化一个 OCRWorker 实例"""
-        mp.current_process().worker = OCRWorker()
+        self._context = mp.get_context("spawn")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._workers: Dict[int, _Worker] = {}
+        self._pending: deque[_Job] = deque()
+        self._stopping = False
+        self._restarts = 0
+        self._ipc_count = 0
+        self._ipc_seconds = 0.0
 
-    def _initialize(self):
-        """初始化进程池和信号量"""
-        if self._pool is None:
-            self._pool = Pool(
-                processes=settings.OCR_NUM_WORKERS,
-                initializer=self._initialize_worker
-            )
-            self._semaphore = asyncio.Semaphore(settings.OCR_NUM_WORKERS)
-            self.logger.info(f"OCR进程池初始化完成, 工作进程数: {settings.OCR_NUM_WORKERS}")
+    def start(self):
+        """启动工作进程，需要在事件循环中调用"""
+        if self._loop is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._stopping = False
+        for index in range(settings.OCR_NUM_WORKERS):
+            self._start_worker(index)
+        self.logger.info(f"OCR进程池初始化完成, 工作进程数: {settings.OCR_NUM_WORKERS}")
 
-    @staticmethod
-    def _process_image(image_bytes: bytes) -> List[Dict[str, Any]]:
-        """处理单张图片的包装方法"""
-        return mp.current_process().worker.process_image(image_bytes)
+    def _start_worker(self, index: int):
+        if self._stopping:
+            return
+        # 共享内存在子进程启动前创建，子进程与主进程共用同一个 resource_tracker
+        shm = SharedMemory(create=True, size=settings.OCR_SHM_SLOT_SIZE)
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_conn,),
+            name=f"OCRWorker-{index}",
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        worker = _Worker(index, process, parent_conn, shm)
+        self._workers[index] = worker
+        threading.Thread(
+            target=self._read_loop,
+            args=(self._loop, worker),
+            name=f"ocr-reader-{index}",
+            daemon=True
+        ).start()
 
-    async def process_image_async(self, image_bytes: bytes) -> List[Dict[str, Any]]:
-        """异步处理图片"""
-        async with self._semaphore:
+    def _read_loop(self, loop: asyncio.AbstractEventLoop, worker: _Worker):
+        """读取线程：每个工作进程一个，进程退出时管道关闭，通知事件循环"""
+        while True:
             try:
-                future = self._pool.apply_async(self._process_image, (image_bytes,))
-                loop = asyncio.get_running_loop()
-                result = await loop.run_in_executor(None, future.get)
-                return result
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                # 管道关闭说明进程正在退出，等待进程结束以获得退出码
+                worker.process.join(timeout=5)
+                message = ("exit", None)
+            try:
+                loop.call_soon_threadsafe(self._on_message, worker, *message)
+            except RuntimeError:
+                return  # 事件循环已关闭
+            if message[0] == "exit":
+                return
+
+    def _on_message(self, worker: _Worker, kind: str, payload):
+        if worker.released:
+            return
+        if kind == "ready":
+            worker.ready = True
+        elif kind == "exit":
+            self._on_exit(worker)
+            return
+        else:
+            self._finish(worker, kind, payload)
+        self._dispatch()
+
+    def _finish(self, worker: _Worker, kind: str, payload):
+        """任务完成，记录通信开销，按处理数量和内存决定是否替换进程"""
+        job, worker.job = worker.job, None
+        if worker.timer is not None:
+            worker.timer.cancel()
+            worker.timer = None
+        worker.tasks_done += 1
+        rss = 0
+        if job is not None and not job.future.done():
+            if kind == "done":
+                result, process_time, rss = payload
+                overhead = time.perf_counter() - job.start_time - process_time
+                self._ipc_count += 1
+                self._ipc_seconds += overhead
+                self.logger.debug(f"进程间通信开销: {overhead * 1000:.2f}ms, 图片大小: {len(job.image_bytes)} 字节")
+                job.future.set_result(result)
+            else:
+                job.future.set_exception(RuntimeError(payload))
+
+        if settings.OCR_WORKER_MAX_TASKS and worker.tasks_done >= settings.OCR_WORKER_MAX_TASKS:
+            self._retire(worker, f"已处理 {worker.tasks_done} 张图片")
+        elif settings.OCR_WORKER_MAX_RSS_MB and rss > settings.OCR_WORKER_MAX_RSS_MB * 1024 * 1024:
+            self._retire(worker, f"内存占用 {rss / 1024 / 1024:.0f}MB")
+
+    def _retire(self, worker: _Worker, reason: str):
+        """通知空闲的工作进程退出，并立即启动替换进程"""
+        self.logger.info(f"替换OCR工作进程 {worker.index}: {reason}")
+        worker.retiring = True
+        try:
+            worker.conn.send(None)
+        except OSError:
+            pass
+        self._workers.pop(worker.index, None)
+        self._start_worker(worker.index)
+
+    def _on_timeout(self, worker: _Worker):
+        job = worker.job
+        if job is not None and not job.future.done():
+            job.future.set_exception(TimeoutError(f"OCR处理超时 ({settings.OCR_TASK_TIMEOUT}秒)"))
+        self.logger.error(f"OCR工作进程 {worker.index} 处理超时, 终止进程")
+        worker.process.kill()
+
+    def _on_exit(self, worker: _Worker):
+        """工作进程退出：回收资源，异常退出时让当前任务失败并补充新进程"""
+        worker.release()
+        if worker.retiring or self._stopping:
+            return
+
+        job = worker.job
+        if job is not None and not job.future.done():
+            job.future.set_exception(RuntimeError("OCR工作进程异常退出"))
+        self.logger.error(f"OCR工作进程 {worker.index} 异常退出, 退出码: {worker.process.exitcode}")
+        if self._workers.get(worker.index) is worker:
+            del self._workers[worker.index]
+            self._restarts += 1
+            # 初始化阶段就退出的进程延迟重启，避免反复快速重启
+            delay = 0 if worker.ready else settings.OCR_WORKER_RESTART_DELAY
+            self._loop.call_later(delay, self._start_worker, worker.index)
+
+    def _write_slot(self, worker: _Worker, image_bytes: bytes) -> SharedMemory:
+        """把图片写入工作进程的槽位，图片超过槽位大小时换成更大的共享内存"""
+        if len(image_bytes) > worker.shm.size:
+            worker.shm.close()
+            worker.shm.unlink()
+            worker.shm = SharedMemory(create=True, size=len(image_bytes))
+            self.logger.info(f"工作进程 {worker.index} 的共享内存扩容至 {len(image_bytes)} 字节")
+        worker.shm.buf[:len(image_bytes)] = image_bytes
+        return worker.shm
+
+    def _dispatch(self):
+        """把等待中的任务分配给空闲的工作进程"""
+        idle = [
+            worker for worker in self._workers.values()
+            if worker.ready and not worker.retiring and worker.job is None
+        ]
+        while idle and self._pending:
+            job = self._pending.popleft()
+            if job.future.done():
+                continue  # 等待方已取消
+            worker = idle.pop()
+            try:
+                shm = self._write_slot(worker, job.image_bytes)
+                worker.conn.send((shm.name, len(job.image_bytes), job.regions))
             except Exception as e:
-                self.logger.error(f"异步处理失败: {e}")
-                raise
+                job.future.set_exception(e)
+                continue
+            worker.job = job
+            worker.timer = self._loop.call_later(settings.OCR_TASK_TIMEOUT, self._on_timeout, worker)
+
+    def has_capacity(self, count: int = 1) -> bool:
+        return len(self._pending) + count <= settings.OCR_MAX_QUEUE_SIZE
+
+    @property
+    def ipc_overhead_ms(self) -> float:
+        """平均每张图片的进程间通信开销（毫秒）"""
+        return self._ipc_seconds / self._ipc_count * 1000 if self._ipc_count else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._workers),
+            "ready": sum(worker.ready for worker in self._workers.values()),
+            "busy": sum(worker.job is not None for worker in self._workers.values()),
+            "queued": len(self._pending),
+            "restarts": self._restarts,
+            "ipc_overhead_ms": round(self.ipc_overhead_ms, 3),
+        }
+
+    async def process_image_async(
+        self,
+        image_bytes: bytes,
+        regions: Optional[List[List[int]]] = None
+    ) -> List[Dict[str, Any]]:
+        """异步处理图片，只识别 regions 中的区域（可选），等待队列已满时抛出 OCRBusyError"""
+        self.start()
+        if not self.has_capacity():
+            raise OCRBusyError("OCR服务繁忙")
+        job = _Job(image_bytes, regions, self._loop.create_future())
+        self._pending.append(job)
+        self._dispatch()
+        try:
+            return await job.future
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"异步处理失败: {e}")
+            raise
 
     async def cleanup(self):
-        """清理资源"""
-        if self._pool:
-            loop = asyncio.get_running_loop()
-            await loop.run_in_executor(None, self._pool.close)
-            await loop.run_in_executor(None, self._pool.join)
-            self._pool = None
-            self.logger.info("OCR进程池已清理")
+        """通知所有工作进程退出并等待"""
+        if self._loop is None:
+            return
+        self._stopping = True
+        for job in self._pending:
+            job.future.cancel()
+        self._pending.clear()
+        workers = list(self._workers.values())
+        self._workers.clear()
+        for worker in workers:
+            worker.retiring = True
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+
+        def join():
+            for worker in workers:
+                worker.process.join(timeout=5)
+                if worker.process.is_alive():
+                    worker.process.kill()
+                    worker.process.join()
+
+        await self._loop.run_in_executor(None, join)
+        for worker in workers:
+            worker.release()
+        self._loop = None
+        self.logger.info("OCR进程池已清理")
 
     async def __aenter__(self):
+        self.start()
         return self
         
     async def __aexit__(self, exc_type, exc_val, exc_tb):
@@ -0,0 +1,141 @@
+"""
+OCR结果缓存：按图片内容的 SHA-256 缓存识别结果。
+调度器重试、客户端重新上传等重复提交相同图片时直接返回结果，不再识别。
+
+内存中按 LRU 保留 OCR_CACHE_MAX_ENTRIES 条结果；配置 OCR_CACHE_DIR 时同时写入磁盘，
+服务重启后仍可命中，磁盘缓存超过 OCR_CACHE_DISK_MAX_MB 后删除最久未使用的文件
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+from app.core.config import settings
+
+def content_hash(content: bytes) -> str:
+    """图片内容的 SHA-256，客户端用同样的方式计算后查询缓存"""
+    return hashlib.sha256(content).hexdigest()
+
+class ResultCache:
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._memory: OrderedDict[str, list] = OrderedDict()
+        self._disk_lock = threading.Lock()  # 磁盘读写在线程池中进行
+        self._disk_size: Optional[int] = None  # 磁盘缓存的总大小，首次写入时统计
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(digest: str, regions: Optional[List[List[int]]]) -> str:
+        """预处理配置和识别区域不同时结果不同，一并计入缓存键"""
+        parts = [digest.lower(), str(settings.OCR_MAX_SIDE), str(int(settings.OCR_GRAYSCALE))]
+        if regions:
+            parts.append(json.dumps(regions, separators=(",", ":")))
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    def _remember(self, key: str, result: list):
+        if settings.OCR_CACHE_MAX_ENTRIES <= 0:
+            return
+        self._memory[key] = result
+        self._memory.move_to_end(key)
+        while len(self._memory) > settings.OCR_CACHE_MAX_ENTRIES:
+            self._memory.popitem(last=False)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(settings.OCR_CACHE_DIR, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[list]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                result = json.loads(f.read())
+            # 更新修改时间，淘汰时按修改时间删除最久未使用的文件
+            os.utime(path)
+            return result
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.logger.warning(f"读取OCR结果缓存失败 {path}: {str(e)}")
+            return None
+
+    def _scan_disk(self) -> List[tuple]:
+        """磁盘缓存中的所有文件 (修改时间, 大小, 路径)"""
+        files = []
+        for root, _, names in os.walk(settings.OCR_CACHE_DIR):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _write_disk(self, key: str, result: list):
+        path = self._path(key)
+        data = json.dumps(result, ensure_ascii=False).encode()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        with self._disk_lock:
+            if self._disk_size is None:
+                self._disk_size = sum(size for _, size, _ in self._scan_disk())
+            try:
+                self._disk_size -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(temp_path, path)
+            self._disk_size += len(data)
+
+            limit = settings.OCR_CACHE_DISK_MAX_MB * 1024 * 1024
+            if self._disk_size > limit:
+                # 删除到上限的 90%，避免每次写入都要扫描目录
+                files = sorted(self._scan_disk())
+                self._disk_size = sum(size for _, size, _ in files)
+                for _, size, file_path in files:
+                    if self._disk_size <= limit * 0.9:
+                        break
+                    try:
+                        os.remove(file_path)
+                    except FileNotFoundError:
+                        pass
+                    self._disk_size -= size
+
+    async def get(self, digest: str, regions: Optional[List[List[int]]] = None) -> Optional[list]:
+        """查询缓存，未命中时返回 None"""
+        key = self._key(digest, regions)
+        result = self._memory.get(key)
+        if result is not None:
+            self._memory.move_to_end(key)
+        elif settings.OCR_CACHE_DIR:
+            result = await asyncio.to_thread(self._read_disk, key)
+            if result is not None:
+                self._remember(key, result)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    async def put(self, digest: str, regions: Optional[List[List[int]]], result: list):
+        key = self._key(digest, regions)
+        self._remember(key, result)
+        if settings.OCR_CACHE_DIR:
+            try:
+                await asyncio.to_thread(self._write_disk, key, result)
+            except OSError as e:
+                self.logger.warning(f"写入OCR结果缓存失败: {str(e)}")
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._memory),
+            "disk_bytes": self._disk_size,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
@@ -0,0 +1,48 @@
+"""
+OCR进程间通信开销压测
+
+用不同大小的图片调用 OCRProcessor，统计每张图片的往返耗时减去工作进程处理耗时，
+即图片交给工作进程、结果交回事件循环的开销。图片为未压缩的空白 BMP，
+文件大小随分辨率增长，识别本身很快。
+
+用法（在 ocr-service 目录下）:
+    python -m benchmarks.ocr_ipc_overhead --images 20 --sizes 640x360 1920x1080 3840x2160
+"""
+import argparse
+import asyncio
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from app.services.ocr_processor import OCRProcessor
+
+
+def make_image(width: int, height: int) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", (width, height), (255, 255, 255)).save(buffer, format="BMP")
+    return buffer.getvalue()
+
+
+async def main(args):
+    async with OCRProcessor() as processor:
+        # 预热：工作进程加载模型、映射共享内存
+        await processor.process_image_async(make_image(64, 64))
+        for size in args.sizes:
+            width, height = (int(value) for value in size.split("x"))
+            image = make_image(width, height)
+            count, seconds = processor._ipc_count, processor._ipc_seconds
+            start = time.perf_counter()
+            for _ in range(args.images):
+                await processor.process_image_async(image)
+            elapsed = time.perf_counter() - start
+            overhead = (processor._ipc_seconds - seconds) / (processor._ipc_count - count) * 1000
+            print(f"{size} ({len(image) / 1024 / 1024:.1f}MB): 每张 {elapsed / args.images * 1000:.1f}ms, "
+                  f"通信开销 {overhead:.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OCR进程间通信开销压测")
+    parser.add_argument("--images", type=int, default=20)
+    parser.add_argument("--sizes", nargs="+", default=["640x360", "1920x1080", "3840x2160"])
+    asyncio.run(main(parser.parse_args()))
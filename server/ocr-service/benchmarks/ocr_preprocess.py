@@ -0,0 +1,112 @@
+"""
+OCR预处理的耗时/准确率对比
+
+对样本集中的每张图片分别用不同的预处理配置（OCR_MAX_SIDE、OCR_GRAYSCALE）识别，
+统计平均耗时和单词召回率，用于在 CPU 节点上选择能跟上截图频率、又不明显损失识别率的配置。
+
+不指定 --corpus 时生成带文字的合成截图（默认 3840x2160），以绘制的单词为标准答案；
+指定样本目录时以不做预处理的识别结果为标准答案。
+
+用法（在 ocr-service 目录下）:
+    python -m benchmarks.ocr_preprocess --corpus ~/screenshots --images 20
+    python -m benchmarks.ocr_preprocess --configs 0 2560 1920 1920:gray 1280
+"""
+import argparse
+import os
+import random
+import string
+import time
+from collections import Counter
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFont
+
+from app.core.config import settings
+from app.services.ocr_processor import OCRWorker
+
+
+def make_screenshot(width: int, height: int, font_size: int) -> tuple[bytes, list[str]]:
+    """白底黑字的合成截图，随机单词组成的文字行，返回图片和绘制的单词"""
+    image = Image.new("RGB", (width, height), (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default(size=font_size)
+    drawn = []
+    y = font_size
+    while y < height - font_size * 2:
+        words = [
+            "".join(random.choices(string.ascii_letters, k=random.randint(3, 9)))
+            for _ in range(random.randint(3, 10))
+        ]
+        draw.text((random.randint(10, width // 3), y), " ".join(words), fill=(0, 0, 0), font=font)
+        drawn.extend(words)
+        y += int(font_size * random.uniform(1.6, 3))
+    buffer = BytesIO()
+    image.save(buffer, format="WEBP", quality=90)
+    return buffer.getvalue(), drawn
+
+
+def load_corpus(args) -> tuple[list[bytes], list[list[str]] | None]:
+    if args.corpus:
+        names = sorted(
+            name for name in os.listdir(args.corpus)
+            if os.path.splitext(name)[1].lower() in (".png", ".jpg", ".jpeg", ".webp", ".bmp")
+        )[:args.images]
+        images = []
+        for name in names:
+            with open(os.path.join(args.corpus, name), "rb") as f:
+                images.append(f.read())
+        return images, None
+    random.seed(0)
+    samples = [make_screenshot(args.width, args.height, args.font_size) for _ in range(args.images)]
+    return [image for image, _ in samples], [words for _, words in samples]
+
+
+def words_of(result: list[dict]) -> list[str]:
+    return [word for item in result for word in item["text"].split()]
+
+
+def recall(expected: list[list[str]], actual: list[list[str]]) -> float:
+    """标准答案中被识别出的单词比例，不受文字行顺序影响"""
+    found = sum(sum((Counter(e) & Counter(a)).values()) for e, a in zip(expected, actual))
+    return found / max(1, sum(len(e) for e in expected))
+
+
+def run(worker: OCRWorker, images: list[bytes], max_side: int, grayscale: bool) -> tuple[float, list[list[str]]]:
+    settings.OCR_MAX_SIDE = max_side
+    settings.OCR_GRAYSCALE = grayscale
+    words = []
+    start = time.perf_counter()
+    for image in images:
+        words.append(words_of(worker.process_image(image)))
+    return (time.perf_counter() - start) / len(images), words
+
+
+def main(args):
+    images, expected = load_corpus(args)
+    worker = OCRWorker()
+    # 预热，避免第一张图片计入模型加载
+    worker.process_image(images[0])
+
+    baseline_time, baseline = run(worker, images, 0, False)
+    expected = expected or baseline
+    print(f"样本 {len(images)} 张, 基准（不预处理）: 每张 {baseline_time * 1000:.0f}ms, "
+          f"单词召回率 {recall(expected, baseline):.3f}")
+    for config in args.configs:
+        max_side, _, mode = config.partition(":")
+        elapsed, words = run(worker, images, int(max_side), mode == "gray")
+        print(f"{config:>12}: 每张 {elapsed * 1000:.0f}ms ({baseline_time / elapsed:.2f}x), "
+              f"单词召回率 {recall(expected, words):.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OCR预处理的耗时/准确率对比")
+    parser.add_argument("--corpus", help="样本图片目录，不指定时生成合成截图")
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--width", type=int, default=3840)
+    parser.add_argument("--height", type=int, default=2160)
+    parser.add_argument("--font-size", type=int, default=28)
+    parser.add_argument(
+        "--configs", nargs="+", default=["2560", "1920", "1920:gray", "1280"],
+        help="最长边[:gray]，0 表示不缩小"
+    )
+    main(parser.parse_args())